@@ -6,151 +6,404 @@ Flask приложение для обработки вебхуков Битри
 """
 
 import os
-import json
+import time
 import logging
-import requests
-from flask import Flask, request, jsonify
+from functools import partial
+from flask import Flask, Response, request, jsonify
 from datetime import datetime
 
+from bitrix_client import BitrixAPI, BatchRequest
+from contact_cache import TTLCache
+from contact_store import ContactStore
+from deal_index import DealIndex, reasons_version, history_hash
+from deal_locks import DealLocks
+from deal_queue import DealQueue
+from flow import run_flow
+from own_writes import OwnWritesLog
+from portals import Portal, DEFAULT_PORTAL, load_portals
+from single_flight import SingleFlight
+from write_batcher import WriteBatcher
+from priority import current_priority, event_priority, use_priority
+from log_setup import setup_logging, payload_sampled
+from webhook_payload import parse_payload, HANDLED_EVENTS
+from metrics import EVENTS, EVENT_TO_WRITE_SECONDS, render as render_metrics
+
 # Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/bitrix_webhook.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging('/var/log/bitrix_webhook.log')
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+# Поле контакта с причинами отказов
+REJECTION_REASONS_FIELD = 'UF_CRM_1755175983293'
 
-class BitrixAPI:
-    """Класс для работы с API Битрикс24"""
-    
-    def __init__(self, webhook_url):
-        self.webhook_url = webhook_url.rstrip('/')
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'User-Agent': 'BitrixWebhookHandler/1.0'
-        })
-    
-    def _make_request(self, method, params=None):
-        """Выполнение запроса к API Битрикс24"""
-        url = f"{self.webhook_url}/{method}.json"
-        try:
-            response = self.session.post(url, json=params or {})
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            logger.error(f"API request failed: {e}")
-            return None
-    
-    def get_deal(self, deal_id):
-        """Получение сделки по ID"""
-        return self._make_request('crm.deal.get', {'ID': deal_id})
-    
-    def update_deal(self, deal_id, fields):
-        """Обновление сделки"""
-        return self._make_request('crm.deal.update', {'ID': deal_id, 'fields': fields})
+app = Flask(__name__)
 
 class DealProcessor:
-    """Процессор для обработки сделок"""
+    """
+    Процессор для обработки сделок
+    Обработка написана генераторами *_flow (см. flow.py): синхронный и асинхронный (asgi_app.py)
+    процессоры выполняют один и тот же ход, отличаются только клиент API, группировка записей и run_flow
+    """
+    
+    run_flow = staticmethod(run_flow)
     
-    def __init__(self, api_client):
+    def __init__(self, api_client, portal=None):
         self.api = api_client
+        # Портал задаёт файлы состояния; без него - пути по умолчанию из переменных окружения
+        self.portal = portal or Portal(DEFAULT_PORTAL, api_client.webhook_url)
         self.rejection_history_field = os.getenv('REJECTION_HISTORY_FIELD', 'UF_CRM_1755175908229')
         self.max_field_length = int(os.getenv('MAX_FIELD_LENGTH', '2000'))
+        self.contact_store = ContactStore(db_path=self.portal.db_path('contact_store.db'), portal=self.portal.name)
+        # Последний известный контакт сделки - позволяет не запрашивать контакт, если он есть в локальной копии
+        self.deal_contacts = TTLCache(
+            max_size=int(os.getenv('CONTACT_CACHE_SIZE', '1000')) * 10,
+            ttl=int(os.getenv('CONTACT_CACHE_TTL', '300'))
+        )
+        self.own_writes = OwnWritesLog(db_path=self.portal.db_path('own_writes.db'))
+        self.deal_index = DealIndex(db_path=self.portal.db_path('deal_index.db'))
+        self.deal_locks = DealLocks(db_path=self.portal.db_path('deal_locks.db'), portal=self.portal.name)
+        # Одновременные запросы одного контакта выполняются одним запросом к API
+        self.contact_fetches = SingleFlight()
+        # Обновления сделок из разных потоков отправляются общими batch-запросами
+        self.deal_writes = WriteBatcher(self.api)
+    
+    def build_history_text(self, rejection_reasons):
+        """Формирование текста для поля истории"""
+        history_text = "Предыдущие причины отказов:\n"
+        for i, reason in enumerate(rejection_reasons, 1):
+            history_text += f"{i}. {reason}\n"
+        
+        # Обрезаем до максимальной длины
+        if len(history_text) > self.max_field_length:
+            history_text = history_text[:self.max_field_length-3] + "..."
+        return history_text
+    
+    @staticmethod
+    def is_same_history(current_value, history_text):
+        """Совпадает ли значение поля истории в сделке с новым текстом"""
+        if isinstance(current_value, list):
+            current_value = current_value[0] if len(current_value) == 1 else None
+        return isinstance(current_value, str) and current_value.strip() == history_text.strip()
+    
+    @staticmethod
+    def extract_rejection_reasons(contact):
+        """Разбор причин отказов из данных контакта"""
+        rejection_field = contact.get(REJECTION_REASONS_FIELD, '')
+        
+        if not rejection_field:
+            return []
+        
+        # Если это строка, разбиваем по переносам строк
+        if isinstance(rejection_field, str):
+            reasons = [line.strip() for line in rejection_field.split('\n') if line.strip()]
+        else:
+            reasons = [str(rejection_field).strip()]
+        
+        return [r for r in reasons if r]
     
     def get_contact_rejection_reasons(self, contact_id):
-        """Получение причин отказов из поля контакта"""
+        """
+        Получение причин отказов из поля контакта
+        Возвращает None, если контакт не удалось получить - это не то же самое, что пустой список причин
+        """
+        return self.run_flow(self.contact_reasons_flow(contact_id))
+    
+    def contact_reasons_flow(self, contact_id):
+        """Ход get_contact_rejection_reasons(): локальная копия, иначе один запрос на контакт"""
         try:
-            # Получаем контакт
-            contact_data = self.api._make_request('crm.contact.get', {'ID': contact_id})
-            if not contact_data or 'result' not in contact_data:
-                return []
-            
-            contact = contact_data['result']
-            rejection_field = contact.get('UF_CRM_1755175983293', '')
-            
-            if not rejection_field:
-                return []
-            
-            # Если это строка, разбиваем по переносам строк
-            if isinstance(rejection_field, str):
-                reasons = [line.strip() for line in rejection_field.split('\n') if line.strip()]
-            else:
-                reasons = [str(rejection_field).strip()]
+            reasons = self.contact_store.get(str(contact_id))
+            if reasons is not None:
+                return reasons
             
-            return [r for r in reasons if r]
+            return (yield partial(
+                self.contact_fetches.do, str(contact_id), lambda: self.fetch_contact_rejection_reasons(contact_id)
+            ))
             
         except Exception as e:
             logger.error(f"Error getting contact rejection reasons: {e}")
-            return []
+            return None
+    
+    def fetch_contact_rejection_reasons(self, contact_id):
+        """Запрос контакта из API и сохранение его причин отказов в локальную копию"""
+        return self.run_flow(self.fetch_contact_flow(contact_id))
+    
+    def fetch_contact_flow(self, contact_id):
+        """Ход fetch_contact_rejection_reasons()"""
+        started = time.time()
+        contact_data = yield partial(self.api._make_request, 'crm.contact.get', {'ID': contact_id})
+        if not contact_data or 'result' not in contact_data:
+            logger.error(f"Failed to get contact {contact_id}: {(contact_data or {}).get('error', 'no response')}")
+            return None
+        
+        reasons = self.extract_rejection_reasons(contact_data['result'])
+        self.contact_store.put(str(contact_id), reasons, started)
+        return reasons
+    
+    def can_skip_update(self, deal_id):
+        """
+        Не может ли ONCRMDEALUPDATE изменить поле истории - только по локальному состоянию
+        Сделка уже обработана, причины отказов её контакта и итоговый текст с тех пор не менялись.
+        Смену контакта в сделке по событию не видно, поэтому запись индекса живёт не дольше DEAL_INDEX_TTL
+        """
+        entry = self.deal_index.get(deal_id)
+        if not entry:
+            return False
+        contact_id, stored_history_hash, stored_version = entry
+        reasons = self.contact_store.get(contact_id)
+        if reasons is None:
+            return False
+        history_text = self.build_history_text(reasons) if reasons else None
+        return reasons_version(reasons) == stored_version and history_hash(history_text) == stored_history_hash
+    
+    def sync_contacts(self):
+        """Инкрементальная синхронизация локальной копии контактов, возвращает число загруженных"""
+        return self.contact_store.sync(self.api, REJECTION_REASONS_FIELD, self.extract_rejection_reasons)
+    
+    @staticmethod
+    def deal_with_contact_batch(deal_id):
+        """Batch-запрос сделки и её контакта"""
+        batch = BatchRequest()
+        batch.add('deal', 'crm.deal.get', {'ID': deal_id})
+        batch.add('contact', 'crm.contact.get', {'ID': BatchRequest.ref('deal', 'CONTACT_ID')})
+        return batch
+    
+    @staticmethod
+    def unpack_deal_with_contact(batch_result):
+        """Разбор результата deal_with_contact_batch(): (сделка, контакт)"""
+        if not batch_result:
+            return None, None
+        
+        deal = batch_result['result'].get('deal')
+        contact = batch_result['result'].get('contact')
+        if 'contact' in batch_result['errors'] and deal and deal.get('CONTACT_ID'):
+            logger.error(f"Failed to get contact {deal['CONTACT_ID']}: {batch_result['errors']['contact']}")
+        return deal, contact
     
-    def process_new_deal(self, deal_id):
-        """Обработка новой сделки"""
+    def fetch_deal_and_reasons(self, deal_id):
+        """
+        Получение сделки и причин отказов её контакта
+        Причины None, если контакт сделки не удалось получить.
+        Если локальная копия контактов синхронизирована или контакт сделки уже известен и есть в ней,
+        запрашивается только сделка; иначе сделка и контакт - одним batch-запросом
+        """
+        return self.run_flow(self.deal_and_reasons_flow(deal_id))
+    
+    def deal_and_reasons_flow(self, deal_id):
+        """Ход fetch_deal_and_reasons()"""
+        hinted_contact_id = self.deal_contacts.get(deal_id)
+        reasons = self.contact_store.get(hinted_contact_id) if hinted_contact_id else None
+        
+        if reasons is not None or self.contact_store.is_synced():
+            deal_data = yield partial(self.api.get_deal, deal_id)
+            deal = deal_data.get('result') if deal_data else None
+            if deal and deal.get('CONTACT_ID') and (reasons is None or str(deal['CONTACT_ID']) != hinted_contact_id):
+                reasons = yield from self.contact_reasons_flow(deal['CONTACT_ID'])
+        else:
+            started = time.time()
+            batch_result = yield partial(self.api.call_batch, self.deal_with_contact_batch(deal_id))
+            deal, contact = self.unpack_deal_with_contact(batch_result)
+            reasons = self.extract_rejection_reasons(contact) if contact else None
+            if deal and contact:
+                self.contact_store.put(str(deal['CONTACT_ID']), reasons, started)
+        
+        if not deal or not deal.get('CONTACT_ID'):
+            return deal, []
+        self.deal_contacts.put(deal_id, str(deal['CONTACT_ID']))
+        return deal, reasons
+    
+    def process_new_deal(self, deal_id, received_at=None):
+        """
+        Обработка новой сделки под блокировкой сделки (общей для всех процессов)
+        received_at - время получения события, для метрики задержки до записи в сделку
+        """
+        return self.deal_locks.run(deal_id, lambda: self.process_unlocked(deal_id, received_at))
+    
+    def process_unlocked(self, deal_id, received_at=None):
+        """Обработка сделки без блокировки: получение сделки, причин отказов и запись истории"""
+        return self.run_flow(self.process_flow(deal_id, received_at))
+    
+    def process_flow(self, deal_id, received_at=None):
+        """Ход process_unlocked()"""
         try:
             logger.info(f"Processing deal {deal_id}")
             
-            # Получаем сделку
-            deal_data = self.api.get_deal(deal_id)
-            if not deal_data or 'result' not in deal_data:
+            # Получаем сделку и причины отказов контакта
+            deal, rejection_reasons = yield from self.deal_and_reasons_flow(deal_id)
+            if not deal:
                 logger.error(f"Failed to get deal {deal_id}")
                 return False
             
-            deal = deal_data['result']
-            contact_id = deal.get('CONTACT_ID')
-            
-            if not contact_id:
-                logger.warning(f"Deal {deal_id} has no contact")
-                return False
-            
-            logger.info(f"Processing deal {deal_id} for contact {contact_id}")
-            
-            # Получаем причины отказов из поля контакта
-            rejection_reasons = self.get_contact_rejection_reasons(contact_id)
-            logger.info(f"Found {len(rejection_reasons)} rejection reasons in contact {contact_id}")
-            
-            if not rejection_reasons:
-                logger.info(f"No rejection reasons found for contact {contact_id}")
-                return True
-            
-            # Формируем текст для поля истории
-            history_text = "Предыдущие причины отказов:\n"
-            for i, reason in enumerate(rejection_reasons, 1):
-                history_text += f"{i}. {reason}\n"
-            
-            # Обрезаем до максимальной длины
-            if len(history_text) > self.max_field_length:
-                history_text = history_text[:self.max_field_length-3] + "..."
-            
-            # Обновляем сделку
-            update_result = self.api.update_deal(deal_id, {
-                self.rejection_history_field: [history_text]
-            })
-            
-            if update_result and update_result.get('result'):
-                logger.info(f"Successfully updated deal {deal_id} with {len(rejection_reasons)} rejection reasons")
-                return True
-            else:
-                logger.error(f"Failed to update deal {deal_id}")
-                return False
+            return (yield from self.fill_history_flow(deal, rejection_reasons, received_at))
                 
         except Exception as e:
             logger.error(f"Error processing deal {deal_id}: {e}")
             return False
 
-# Инициализация API клиента
-webhook_url = os.getenv('BITRIX_WEBHOOK_URL')
-if webhook_url:
-    api = BitrixAPI(webhook_url)
-    deal_processor = DealProcessor(api)
-    logger.info("Deal processor initialized")
+    def fill_rejection_history(self, deal, rejection_reasons, received_at=None):
+        """
+        Запись истории причин отказов в уже полученную сделку
+        Возвращает False, если запись не удалась; сделку без контакта заполнять нечем - это не ошибка
+        (привязка контакта вызовет ONCRMDEALUPDATE, и сделка будет обработана снова)
+        rejection_reasons None - контакт не получен: сделка не заполняется и не попадает в индекс,
+        обработку повторит очередь
+        """
+        return self.run_flow(self.fill_history_flow(deal, rejection_reasons, received_at))
+    
+    def fill_history_flow(self, deal, rejection_reasons, received_at=None):
+        """Ход fill_rejection_history()"""
+        if self.contact_read_failed(deal, rejection_reasons):
+            return False
+        history_text = self.prepare_history(deal, rejection_reasons)
+        if history_text is None:
+            return True
+        
+        # Обновляем сделку
+        update_result = yield partial(self.deal_writes.update, int(deal['ID']), {
+            self.rejection_history_field: [history_text]
+        })
+        
+        return self.finish_history(deal, rejection_reasons, history_text, update_result, received_at)
+    
+    @staticmethod
+    def contact_read_failed(deal, rejection_reasons):
+        """Не удалось получить контакт сделки"""
+        if rejection_reasons is None and deal.get('CONTACT_ID'):
+            logger.error(f"Deal {deal['ID']}: contact {deal['CONTACT_ID']} not received, deal will be retried")
+            return True
+        return False
+    
+    def prepare_history(self, deal, rejection_reasons):
+        """Текст истории, который нужно записать в сделку, или None, если записывать нечего"""
+        deal_id = int(deal['ID'])
+        contact_id = deal.get('CONTACT_ID')
+        
+        if not contact_id:
+            logger.warning(f"Deal {deal_id} has no contact")
+            return None
+        
+        logger.info(f"Processing deal {deal_id} for contact {contact_id}")
+        
+        logger.info(f"Found {len(rejection_reasons)} rejection reasons in contact {contact_id}")
+        
+        if not rejection_reasons:
+            logger.info(f"No rejection reasons found for contact {contact_id}")
+            self.deal_index.record(deal_id, contact_id, None, rejection_reasons)
+            return None
+        
+        history_text = self.build_history_text(rejection_reasons)
+        
+        # Не пишем то же самое: лишний update порождает ещё одно ONCRMDEALUPDATE
+        if self.is_same_history(deal.get(self.rejection_history_field), history_text):
+            logger.info(f"Deal {deal_id} history is up to date, skipping update")
+            self.deal_index.record(deal_id, contact_id, history_text, rejection_reasons)
+            return None
+        
+        # Отмечаем запись до вызова API: эхо-событие может прийти раньше ответа
+        self.own_writes.record(deal_id)
+        return history_text
+    
+    def finish_history(self, deal, rejection_reasons, history_text, update_result, received_at=None):
+        """Учёт результата записи истории в сделку, возвращает True при успехе"""
+        deal_id = int(deal['ID'])
+        if update_result and update_result.get('result'):
+            logger.info(f"Successfully updated deal {deal_id} with {len(rejection_reasons)} rejection reasons")
+            self.deal_index.record(deal_id, deal['CONTACT_ID'], history_text, rejection_reasons)
+            if received_at:
+                EVENT_TO_WRITE_SECONDS.labels(current_priority(), self.portal.name).observe(time.time() - received_at)
+            return True
+        else:
+            self.own_writes.forget(deal_id)
+            self.deal_index.forget(deal_id)
+            logger.error(f"Failed to update deal {deal_id}")
+            return False
+
+# Порталы и их процессоры: у каждого портала свой клиент API (пул соединений) и лимит запросов
+portals = load_portals()
+deal_processors = {
+    portal.name: DealProcessor(
+        BitrixAPI(
+            portal.webhook_url, rate_limiter=portal.rate_limiter(), circuit_breaker=portal.circuit_breaker(),
+            portal=portal.name
+        ),
+        portal
+    )
+    for portal in portals
+}
+if deal_processors:
+    logger.info("Deal processors initialized for portals: {}".format(', '.join(deal_processors)))
 else:
-    logger.error("BITRIX_WEBHOOK_URL not configured")
-    deal_processor = None
+    logger.error("BITRIX_WEBHOOK_URL or PORTALS_CONFIG not configured")
+
+# Режим приёма: sync - обработка в запросе, queue - только запись в очередь (см. queue_worker.py)
+# Очередь нужна и в режиме sync: в неё попадают повторы сделок, которые не удалось обработать
+webhook_mode = os.getenv('WEBHOOK_MODE', 'sync')
+deal_queue = DealQueue()
+
+# Маршруты, принимающие вебхуки (те же подключены в asgi_app.py)
+WEBHOOK_ROUTES = [
+    '/webhook/deal',
+    '/webhook',
+    '/bitrix/webhook',
+    '/bitrix/webhook/deal',
+    '/api/webhook',
+    '/api/webhook/deal'
+]
+
+def dispatch_event(payload, route):
+    """
+    Обработка события вебхука (общая для Flask и ASGI приложений)
+    payload - результат webhook_payload.parse_payload, route - путь запроса для метрик
+    Возвращает ((портал, ID сделки), None, None), если сделку нужно обработать сразу,
+    иначе (None, ответ, HTTP-код)
+    """
+    event = payload['event']
+    entity_id = payload['id']
+    portal = portals.resolve(payload['token'], payload['domain'])
+    # Метки только из фиксированного набора: запросы с произвольным event или токеном не создают новых серий
+    EVENTS.labels(event if event in HANDLED_EVENTS else 'other', route, portal.name if portal else 'unknown').inc()
+    
+    if event not in HANDLED_EVENTS:
+        logger.info("Ignoring event {}".format(event))
+        return None, {'message': 'Event ignored'}, 200
+    
+    # Токен приложения задаётся в настройках исходящего вебхука портала
+    if not portal:
+        logger.warning("Rejected {} from {}: unknown portal or invalid application token".format(
+            event, payload['domain'] or 'unknown domain'))
+        return None, {'error': 'Invalid application token'}, 401
+    
+    deal_processor = deal_processors[portal.name]
+    
+    if event == 'ONCRMCONTACTUPDATE':
+        if entity_id:
+            deal_processor.contact_store.invalidate(str(entity_id))
+            logger.info("Contact {} cache invalidated for portal {}".format(entity_id, portal.name))
+        return None, {'message': 'Contact cache invalidated'}, 200
+    
+    if not entity_id:
+        return None, {'error': 'Deal ID not found'}, 400
+    
+    deal_id = int(entity_id)
+    
+    if event == 'ONCRMDEALUPDATE' and deal_processor.own_writes.consume(deal_id):
+        logger.info("Ignoring echo of own update for deal {}".format(deal_id))
+        return None, {'message': 'Own update ignored'}, 200
+    
+    if event == 'ONCRMDEALUPDATE' and deal_processor.can_skip_update(deal_id):
+        logger.info("Ignoring update of deal {}: history cannot change".format(deal_id))
+        return None, {'message': 'Update does not affect history'}, 200
+    
+    if webhook_mode == 'queue':
+        deal_queue.put(deal_id, event, portal.name)
+        logger.info("Deal {} of portal {} queued".format(deal_id, portal.name))
+        return None, {'message': 'Deal queued'}, 202
+    
+    # Портал недоступен: отвечаем сразу, сделка обрабатывается повтором из очереди
+    if deal_processor.api.circuit_breaker.is_open():
+        deal_queue.schedule_retry(deal_id, event, portal.name)
+        logger.warning("Deal {} of portal {} scheduled for retry: circuit breaker is open".format(deal_id, portal.name))
+        return None, {'error': 'Bitrix24 is unavailable, retry scheduled'}, 503
+    
+    return (portal.name, deal_id), None, None
 
 @app.route('/webhook/deal', methods=['POST'])
 def deal_webhook():
@@ -158,45 +411,44 @@ def deal_webhook():
     Обработчик вебхука для событий сделок
     Ожидает события создания сделки от Битрикс24
     """
+    received_at = time.time()
     try:
-        if not deal_processor:
+        if not deal_processors:
             return jsonify({'error': 'Service not configured'}), 500
         
-        # Получаем данные вебхука
-        data = request.get_json()
+        # Получаем данные вебхука (форма Битрикс24 или JSON)
+        body = request.get_data()
+        payload = parse_payload(body, request.content_type)
         
-        if not data:
+        if not payload:
             return jsonify({'error': 'No data provided'}), 400
         
-        # Логируем ВСЕ входящие запросы для отладки
-        logger.info("=== WEBHOOK RECEIVED ===")
-        logger.info("Headers: {}".format(dict(request.headers)))
-        logger.info("Raw data: {}".format(request.get_data()))
-        logger.info("JSON data: {}".format(json.dumps(data, ensure_ascii=False)))
-        logger.info("========================")
-        
-        # Извлекаем информацию о событии
-        event = data.get('event')
-        deal_id = data.get('data', {}).get('FIELDS', {}).get('ID')
-        auth_data = data.get('auth', {})
-
-        if event not in ['ONCRMDEALADD', 'ONCRMDEALUPDATE']:
-            logger.info("Ignoring event {}".format(event))
-            return jsonify({'message': 'Event ignored'}), 200
-        
-        if not deal_id:
-            return jsonify({'error': 'Deal ID not found'}), 400
+        if payload['event'] in HANDLED_EVENTS:
+            logger.info("Webhook received", extra={'fields': {
+                'path': request.path, 'event': payload['event'], 'bytes': len(body)
+            }})
+            # Полностью запрос пишется только для выборки запросов или при LOG_LEVEL=DEBUG
+            if payload_sampled(logger):
+                logger.info("Webhook payload", extra={'fields': {
+                    'headers': dict(request.headers), 'body': body.decode('utf-8', 'replace')
+                }})
         
-        deal_id = int(deal_id)
+        target, response, status = dispatch_event(payload, request.path)
+        if not target:
+            return jsonify(response), status
         
-        # Исходящие вебхуки не предоставляют API токены, используем глобальный API клиент
-        logger.info("Processing deal {} with global API client".format(deal_id))
-        success = deal_processor.process_new_deal(deal_id)
+        # Исходящие вебхуки не предоставляют API токены, используем клиент API портала
+        portal_name, deal_id = target
+        logger.info("Processing deal {} with API client of portal {}".format(deal_id, portal_name))
+        # Новые сделки обслуживаются лимитом запросов раньше изменений и фоновой работы
+        with use_priority(event_priority(payload['event'])):
+            success = deal_processors[portal_name].process_new_deal(deal_id, received_at)
         
         if success:
             return jsonify({'message': 'Deal processed successfully'}), 200
         else:
-            return jsonify({'error': 'Failed to process deal'}), 500
+            deal_queue.schedule_retry(deal_id, payload['event'], portal_name)
+            return jsonify({'error': 'Failed to process deal, retry scheduled'}), 500
             
     except Exception as e:
         logger.error("Webhook processing error: {}".format(e))
@@ -237,14 +489,37 @@ def api_deal_webhook():
     """
     return deal_webhook()
 
+def health_status(processors):
+    """Состояние сервиса для /health"""
+    portals_status = {
+        name: {
+            'circuit': processor.api.circuit_breaker.stats(),
+            'contact_store': processor.contact_store.stats()
+        }
+        for name, processor in processors.items()
+    }
+    # Недоступность Битрикс24 не повод перезапускать сервис, поэтому код ответа остаётся 200
+    degraded = any(status['circuit']['state'] != 'closed' for status in portals_status.values())
+    return {
+        'status': 'degraded' if degraded else 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'webhook_configured': bool(processors),
+        'mode': webhook_mode,
+        'queue': deal_queue.stats(),
+        'portals': portals_status
+    }
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Проверка здоровья сервиса"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
-        'webhook_configured': deal_processor is not None
-    })
+    return jsonify(health_status(deal_processors))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики в формате Prometheus"""
+    breakers = [processor.api.circuit_breaker for processor in deal_processors.values()]
+    output, content_type = render_metrics(deal_queue, breakers)
+    return Response(output, content_type=content_type)
 
 @app.route('/', methods=['GET'])
 def root():
@@ -253,15 +528,7 @@ def root():
         'service': 'Bitrix24 Deal Webhook Handler',
         'version': '1.0.0',
         'status': 'running',
-        'endpoints': [
-            '/webhook/deal',
-            '/webhook',
-            '/bitrix/webhook',
-            '/bitrix/webhook/deal',
-            '/api/webhook',
-            '/api/webhook/deal',
-            '/health'
-        ]
+        'endpoints': WEBHOOK_ROUTES + ['/health', '/metrics']
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ASGI-вариант сервиса вебхуков Битрикс24
+Те же маршруты и логика, что в app.py, но сделки обрабатываются асинхронно:
+один процесс держит сотни сделок в работе на общем пуле соединений
+Запуск: uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from app import DealProcessor, WEBHOOK_ROUTES, dispatch_event, health_status, portals, deal_queue
+from webhook_payload import parse_payload
+from metrics import render as render_metrics
+from bitrix_async_client import AsyncBitrixAPI
+from single_flight import AsyncSingleFlight
+from write_batcher import AsyncWriteBatcher
+from flow import run_flow_async
+from priority import event_priority, use_priority
+
+logger = logging.getLogger('asgi_app')
+
+
+class AsyncDealProcessor(DealProcessor):
+    """
+    Асинхронный процессор сделок поверх AsyncBitrixAPI
+    Ход обработки общий с DealProcessor; методы возвращают корутины
+    """
+
+    run_flow = staticmethod(run_flow_async)
+
+    def __init__(self, api_client, portal=None):
+        super().__init__(api_client, portal)
+        self.contact_fetches = AsyncSingleFlight()
+        self.deal_writes = AsyncWriteBatcher(self.api)
+
+    async def process_new_deal(self, deal_id, received_at=None):
+        """Обработка новой сделки под блокировкой сделки (общей для всех процессов)"""
+        return await self.deal_locks.run_async(deal_id, lambda: self.process_unlocked(deal_id, received_at))
+
+
+# Процессоры порталов; у каждого свой пул соединений и лимит запросов
+deal_processors = {}
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    """Создание клиентов API порталов при старте и закрытие пулов соединений при остановке"""
+    for portal in portals:
+        deal_processors[portal.name] = AsyncDealProcessor(
+            AsyncBitrixAPI(
+                portal.webhook_url, rate_limiter=portal.rate_limiter(), circuit_breaker=portal.circuit_breaker(),
+                portal=portal.name
+            ),
+            portal
+        )
+    if deal_processors:
+        logger.info("Async deal processors initialized for portals: {}".format(', '.join(deal_processors)))
+    else:
+        logger.error("BITRIX_WEBHOOK_URL or PORTALS_CONFIG not configured")
+    yield
+    for processor in deal_processors.values():
+        await processor.api.close()
+
+
+async def deal_webhook(request):
+    """Обработчик вебхука для событий сделок"""
+    received_at = time.time()
+    try:
+        if not deal_processors:
+            return JSONResponse({'error': 'Service not configured'}, status_code=500)
+
+        payload = parse_payload(await request.body(), request.headers.get('content-type'))
+        if not payload:
+            return JSONResponse({'error': 'No data provided'}, status_code=400)
+
+        target, response, status = await asyncio.to_thread(dispatch_event, payload, request.url.path)
+        if not target:
+            return JSONResponse(response, status_code=status)
+
+        portal_name, deal_id = target
+        with use_priority(event_priority(payload['event'])):
+            success = await deal_processors[portal_name].process_new_deal(deal_id, received_at)
+        if success:
+            return JSONResponse({'message': 'Deal processed successfully'})
+        await asyncio.to_thread(deal_queue.schedule_retry, deal_id, payload['event'], portal_name)
+        return JSONResponse({'error': 'Failed to process deal, retry scheduled'}, status_code=500)
+
+    except Exception as e:
+        logger.error("Webhook processing error: {}".format(e))
+        return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+
+async def health_check(request):
+    """Проверка здоровья сервиса"""
+    return JSONResponse(await asyncio.to_thread(health_status, deal_processors))
+
+
+async def metrics(request):
+    """Метрики в формате Prometheus"""
+    breakers = [processor.api.circuit_breaker for processor in deal_processors.values()]
+    output, content_type = await asyncio.to_thread(render_metrics, deal_queue, breakers)
+    return Response(output, media_type=content_type)
+
+
+async def root(request):
+    """Корневой маршрут"""
+    return JSONResponse({
+        'service': 'Bitrix24 Deal Webhook Handler (ASGI)',
+        'version': '1.0.0',
+        'status': 'running',
+        'endpoints': WEBHOOK_ROUTES + ['/health', '/metrics']
+    })
+
+
+app = Starlette(
+    routes=[Route(path, deal_webhook, methods=['POST']) for path in WEBHOOK_ROUTES] + [
+        Route('/health', health_check, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/', root, methods=['GET'])
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Заполнение истории причин отказов в существующих сделках
+Сделки читаются по возрастанию ID, контакты и обновления сделок отправляются
+batch-запросами по 50 команд. Прогресс сохраняется в файл, повторный запуск
+продолжает с места остановки; сделки, которые не удалось заполнить, ставятся в очередь
+повторов (их обработает queue_worker.py). --dry-run только считает, сколько сделок будет обновлено,
+и не меняет локальное состояние
+
+Пример: python3 backfill.py --from-id 1 --to-id 200000 --filter CATEGORY_ID=4 --dry-run
+"""
+
+import os
+import json
+import signal
+import logging
+import argparse
+
+from app import deal_processors, deal_queue
+from bitrix_client import BatchRequest
+from portals import DEFAULT_PORTAL
+from priority import PRIORITY_BACKGROUND, set_default_priority
+
+logger = logging.getLogger('backfill')
+
+STAT_KEYS = ('scanned', 'no_contact', 'no_reasons', 'up_to_date', 'writes', 'failed')
+
+
+class Checkpoint:
+    """Прогресс backfill в файле JSON: последний обработанный ID и счётчики"""
+
+    def __init__(self, path, scope):
+        self.path = path
+        self.scope = scope
+        self.last_id = 0
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+
+    def load(self):
+        """Загрузка прогресса, если файл относится к тому же диапазону и фильтру"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('scope') != self.scope:
+            logger.warning(f"Checkpoint {self.path} belongs to another run, starting over")
+            return False
+        self.last_id = data['last_id']
+        self.stats.update(data['stats'])
+        return True
+
+    def save(self, last_id):
+        """Атомарное сохранение прогресса"""
+        self.last_id = last_id
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'scope': self.scope, 'last_id': last_id, 'stats': self.stats}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class Backfill:
+    """Заполнение поля истории по диапазону сделок"""
+
+    def __init__(self, processor, checkpoint, from_id=1, to_id=None, filter=None, dry_run=False, retry_queue=None):
+        self.processor = processor
+        self.checkpoint = checkpoint
+        self.from_id = from_id
+        self.to_id = to_id
+        self.filter = filter or {}
+        self.dry_run = dry_run
+        # Очередь повторов для сделок, которые не удалось заполнить: checkpoint уходит дальше них
+        self.retry_queue = retry_queue
+        self.stopping = False
+
+    def iter_chunks(self):
+        """Сделки диапазона пачками по BatchRequest.MAX_COMMANDS"""
+        field = self.processor.rejection_history_field
+        filter = dict(self.filter)
+        if self.to_id:
+            filter['<=ID'] = self.to_id
+        after_id = max(self.checkpoint.last_id, self.from_id - 1)
+
+        chunk = []
+        for deal in self.processor.api.iter_list('crm.deal.list', filter=filter,
+                                                 select=['ID', 'CONTACT_ID', field], after_id=after_id,
+                                                 raise_errors=True):
+            chunk.append(deal)
+            if len(chunk) == BatchRequest.MAX_COMMANDS:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def fetch_reasons(self, contact_ids):
+        """Причины отказов контактов: из кэша или одним batch-запросом"""
+        reasons = {}
+        batch = BatchRequest()
+        for contact_id in contact_ids:
+            cached = self.processor.contact_store.get(contact_id)
+            if cached is not None:
+                reasons[contact_id] = cached
+            else:
+                batch.add(f"c{contact_id}", 'crm.contact.get', {'ID': contact_id})
+
+        if batch.commands:
+            result = self.processor.api.call_batch(batch)
+            if result is None:
+                raise RuntimeError('Contact batch request failed')
+            for name, contact in result['result'].items():
+                contact_id = name[1:]
+                reasons[contact_id] = self.processor.extract_rejection_reasons(contact)
+                if not self.dry_run:
+                    self.processor.contact_store.put(contact_id, reasons[contact_id])
+            for name, error in result['errors'].items():
+                logger.error(f"Failed to get contact {name[1:]}: {error}")
+        return reasons
+
+    def plan_writes(self, deals, reasons):
+        """Сделки, где поле нужно обновить: {ID сделки: (контакт, текст истории, причины отказов)}"""
+        stats = self.checkpoint.stats
+        writes = {}
+        for deal in deals:
+            stats['scanned'] += 1
+            contact_id = str(deal.get('CONTACT_ID') or '')
+            if not contact_id or contact_id == '0':
+                stats['no_contact'] += 1
+                continue
+            if contact_id not in reasons:
+                self.fail(deal['ID'])
+                continue
+            if not reasons[contact_id]:
+                stats['no_reasons'] += 1
+                if not self.dry_run:
+                    self.processor.deal_index.record(deal['ID'], contact_id, None, reasons[contact_id])
+                continue
+            history_text = self.processor.build_history_text(reasons[contact_id])
+            if self.processor.is_same_history(deal.get(self.processor.rejection_history_field), history_text):
+                stats['up_to_date'] += 1
+                if not self.dry_run:
+                    self.processor.deal_index.record(deal['ID'], contact_id, history_text, reasons[contact_id])
+                continue
+            writes[int(deal['ID'])] = (contact_id, history_text, reasons[contact_id])
+        return writes
+
+    def apply_writes(self, writes):
+        """Обновление сделок одним batch-запросом"""
+        batch = BatchRequest()
+        for deal_id, (_, history_text, _) in writes.items():
+            # Отмечаем запись, чтобы эхо-события не запускали обработку повторно
+            self.processor.own_writes.record(deal_id)
+            batch.add(f"d{deal_id}", 'crm.deal.update', {
+                'ID': deal_id, 'fields': {self.processor.rejection_history_field: [history_text]}
+            })
+
+        result = self.processor.api.call_batch(batch)
+        if result is None:
+            for deal_id in writes:
+                self.processor.own_writes.forget(deal_id)
+            raise RuntimeError('Deal update batch request failed')
+        for deal_id in writes:
+            if result['result'].get(f"d{deal_id}"):
+                self.checkpoint.stats['writes'] += 1
+                self.processor.deal_index.record(deal_id, *writes[deal_id])
+            else:
+                self.processor.own_writes.forget(deal_id)
+                logger.error(f"Failed to update deal {deal_id}: {result['errors'].get(f'd{deal_id}')}")
+                self.fail(deal_id)
+
+    def fail(self, deal_id):
+        """Сделка не заполнена: повтор через очередь, продолжение с checkpoint её уже не увидит"""
+        self.checkpoint.stats['failed'] += 1
+        if self.retry_queue and not self.dry_run:
+            self.retry_queue.schedule_retry(deal_id, 'ONCRMDEALUPDATE', self.processor.portal.name)
+
+    def run(self):
+        """
+        Обработка диапазона с сохранением прогресса после каждой пачки
+        Возвращает False, если обработка остановлена или прервана ошибкой API - повторный запуск продолжит
+        """
+        try:
+            return self.process_chunks()
+        except RuntimeError as e:
+            logger.error(f"Backfill interrupted after deal {self.checkpoint.last_id}: {e}, run again to resume")
+            return False
+
+    def process_chunks(self):
+        """Обработка пачек сделок"""
+        for deals in self.iter_chunks():
+            contact_ids = {str(d['CONTACT_ID']) for d in deals if d.get('CONTACT_ID') and str(d['CONTACT_ID']) != '0'}
+            writes = self.plan_writes(deals, self.fetch_reasons(contact_ids))
+            if self.dry_run:
+                self.checkpoint.stats['writes'] += len(writes)
+            elif writes:
+                self.apply_writes(writes)
+
+            self.checkpoint.save(int(deals[-1]['ID']))
+            logger.info(f"Backfill up to deal {self.checkpoint.last_id}: {self.checkpoint.stats}")
+            if self.stopping:
+                logger.info("Backfill stopped, run again to resume")
+                return False
+        return True
+
+    def stop(self, *_):
+        """Остановка после текущей пачки"""
+        self.stopping = True
+
+
+def parse_filter(values):
+    """Фильтр из аргументов вида CATEGORY_ID=4"""
+    result = {}
+    for value in values or []:
+        key, _, expected = value.partition('=')
+        result[key] = expected
+    return result
+
+
+def main():
+    """Основная функция"""
+    # Старые сделки заполняются только на свободном лимите запросов
+    set_default_priority(PRIORITY_BACKGROUND)
+    parser = argparse.ArgumentParser(description='Заполнение истории причин отказов в существующих сделках')
+    parser.add_argument('--from-id', type=int, default=1, help='первый ID сделки')
+    parser.add_argument('--to-id', type=int, help='последний ID сделки (по умолчанию - до конца)')
+    parser.add_argument('--filter', action='append', metavar='FIELD=VALUE',
+                        help='дополнительный фильтр crm.deal.list, например CATEGORY_ID=4')
+    parser.add_argument('--dry-run', action='store_true', help='только посчитать, сколько сделок будет обновлено')
+    parser.add_argument('--checkpoint', default='backfill_checkpoint.json', help='файл прогресса')
+    parser.add_argument('--restart', action='store_true', help='начать заново, не продолжая по файлу прогресса')
+    parser.add_argument('--portal', help='имя портала из PORTALS_CONFIG (не нужно, если портал один)')
+    args = parser.parse_args()
+
+    if not deal_processors:
+        logger.error("BITRIX_WEBHOOK_URL or PORTALS_CONFIG not configured")
+        return
+    if args.portal:
+        deal_processor = deal_processors.get(args.portal)
+    elif len(deal_processors) == 1:
+        deal_processor = next(iter(deal_processors.values()))
+    else:
+        deal_processor = None
+    if not deal_processor:
+        logger.error(f"Specify --portal, one of: {', '.join(deal_processors)}")
+        return
+
+    filter = parse_filter(args.filter)
+    scope = {'from_id': args.from_id, 'to_id': args.to_id, 'filter': filter, 'dry_run': args.dry_run}
+    # Файлы прогресса режима одного портала остаются действительными
+    if deal_processor.portal.name != DEFAULT_PORTAL:
+        scope['portal'] = deal_processor.portal.name
+    checkpoint = Checkpoint(args.checkpoint, scope)
+    if not args.restart and checkpoint.load():
+        logger.info(f"Resuming backfill after deal {checkpoint.last_id}")
+
+    backfill = Backfill(deal_processor, checkpoint, args.from_id, args.to_id, filter, args.dry_run, deal_queue)
+    signal.signal(signal.SIGTERM, backfill.stop)
+    signal.signal(signal.SIGINT, backfill.stop)
+    completed = backfill.run()
+
+    stats = checkpoint.stats
+    action = 'would be updated' if args.dry_run else 'updated'
+    logger.info(
+        f"Backfill {'completed' if completed else 'paused'}: {stats['scanned']} deals scanned, "
+        f"{stats['writes']} {action}, {stats['up_to_date']} up to date, {stats['no_reasons']} without reasons, "
+        f"{stats['no_contact']} without contact, {stats['failed']} failed"
+        f"{'' if args.dry_run else ' (queued for retry)'}"
+    )
+
+
+if __name__ == '__main__':
+    main()
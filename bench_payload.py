@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Микро-бенчмарк разбора входящего вебхука
+Сравнивает webhook_payload.parse_payload с разбором через Flask (request.form / request.get_json)
+на типичном теле исходящего вебхука Битрикс24
+Запуск: python3 bench_payload.py [--iterations 20000]
+"""
+
+import io
+import json
+import time
+import argparse
+from urllib.parse import urlencode
+
+from flask import Flask, Request
+
+from webhook_payload import parse_payload
+
+FORM_FIELDS = {
+    'event': 'ONCRMDEALUPDATE',
+    'event_handler_id': '27',
+    'data[FIELDS][ID]': '12345',
+    'ts': '1727000000',
+    'auth[domain]': 'example.bitrix24.ru',
+    'auth[client_endpoint]': 'https://example.bitrix24.ru/rest/',
+    'auth[server_endpoint]': 'https://oauth.bitrix.info/rest/',
+    'auth[member_id]': 'a1b2c3d4e5f60718293a4b5c6d7e8f90',
+    'auth[application_token]': 'q1w2e3r4t5y6u7i8o9p0'
+}
+JSON_PAYLOAD = {
+    'event': 'ONCRMDEALUPDATE',
+    'event_handler_id': '27',
+    'data': {'FIELDS': {'ID': '12345'}},
+    'ts': '1727000000',
+    'auth': {key[5:-1]: value for key, value in FORM_FIELDS.items() if key.startswith('auth[')}
+}
+
+CASES = {
+    'form': (urlencode(FORM_FIELDS).encode(), 'application/x-www-form-urlencoded'),
+    'form, ignored event': (urlencode(dict(FORM_FIELDS, event='ONCRMLEADADD')).encode(),
+                            'application/x-www-form-urlencoded'),
+    'json': (json.dumps(JSON_PAYLOAD).encode(), 'application/json')
+}
+
+app = Flask(__name__)
+
+
+def make_environ(body, content_type):
+    """Окружение WSGI для POST-запроса"""
+    return {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/webhook/deal',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'wsgi.url_scheme': 'http',
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body)
+    }
+
+
+def flask_parse(environ):
+    """Разбор так, как это делает Flask"""
+    request = Request(environ)
+    if request.is_json:
+        data = request.get_json()
+        return data['event'], data['data']['FIELDS']['ID'], data['auth']['application_token']
+    form = request.form
+    return form['event'], form.get('data[FIELDS][ID]'), form.get('auth[application_token]')
+
+
+def fast_parse(environ):
+    """Разбор через parse_payload"""
+    request = Request(environ)
+    return parse_payload(request.get_data(), request.content_type)
+
+
+def measure(func, body, content_type, iterations):
+    """Среднее время одного разбора, мкс"""
+    environs = [make_environ(body, content_type) for _ in range(iterations)]
+    started = time.perf_counter()
+    for environ in environs:
+        func(environ)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Бенчмарк разбора вебхука')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'case':<22}{'flask, us':>12}{'parse_payload, us':>20}{'speedup':>10}")
+    for name, (body, content_type) in CASES.items():
+        flask_us = measure(flask_parse, body, content_type, args.iterations)
+        fast_us = measure(fast_parse, body, content_type, args.iterations)
+        print(f"{name:<22}{flask_us:>12.2f}{fast_us:>20.2f}{flask_us / fast_us:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Асинхронный клиент REST API Битрикс24 для ASGI-варианта сервиса (asgi_app.py)
+Ход запроса, разбор ответов и batch-запросов - общие с BitrixAPI (BaseBitrixAPI в bitrix_client.py),
+здесь только транспорт на общем пуле соединений httpx. Общее состояние в SQLite (лимит запросов,
+автомат отключения) читается и пишется в потоках, чтобы ожидание блокировки базы другим процессом
+не останавливало цикл событий
+"""
+
+import os
+import asyncio
+import httpx
+
+from bitrix_client import BaseBitrixAPI, error_result
+from flow import run_flow_async
+
+
+class AsyncBitrixAPI(BaseBitrixAPI):
+    """Асинхронный класс для работы с API Битрикс24: методы возвращают корутины"""
+
+    run_flow = staticmethod(run_flow_async)
+
+    def __init__(self, webhook_url, user_agent='BitrixWebhookHandler/1.0', rate_limiter=None, circuit_breaker=None,
+                 portal='default'):
+        super().__init__(webhook_url, rate_limiter, circuit_breaker, portal)
+
+        pool_size = int(os.getenv('BITRIX_ASYNC_POOL_SIZE', '100'))
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                float(os.getenv('BITRIX_READ_TIMEOUT', '20')),
+                connect=float(os.getenv('BITRIX_CONNECT_TIMEOUT', '5'))
+            ),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            headers={'User-Agent': user_agent}
+        )
+
+    async def close(self):
+        """Закрытие пула соединений"""
+        await self.client.aclose()
+
+    async def _post(self, url, params):
+        """HTTP-запрос: (ответ, None) или (None, ошибка)"""
+        try:
+            return await self.client.post(url, json=params), None
+        except httpx.TimeoutException as e:
+            return None, error_result('TIMEOUT', str(e))
+        except httpx.HTTPError as e:
+            return None, error_result('CONNECTION_ERROR', str(e))
+
+    def _acquire(self, method):
+        """Ожидание права на запрос без блокировки цикла событий"""
+        return self.rate_limiter.acquire_async(method)
+
+    _sleep = staticmethod(asyncio.sleep)
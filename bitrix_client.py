@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Клиент REST API Битрикс24, общий для вебхука, CRON и служебных скриптов
+Пул соединений с keep-alive, таймауты, повтор читающих запросов,
+общий лимит запросов и ошибки в формате Битрикс24 вместо None
+"""
+
+import os
+import time
+import logging
+import requests
+from functools import partial
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import RateLimiter, QUERY_LIMIT_EXCEEDED
+from circuit_breaker import CircuitBreaker, CIRCUIT_OPEN
+from metrics import observe_api_call, API_ERRORS
+from flow import run_flow
+
+logger = logging.getLogger(__name__)
+
+# Методы только на чтение - их безопасно повторять после сетевой ошибки
+READ_METHOD_SUFFIXES = ('.get', '.list', '.fields')
+
+
+def error_result(code, description):
+    """Ошибка в том же формате, что возвращает Битрикс24"""
+    return {'error': code, 'error_description': description}
+
+
+class _Ref(str):
+    """Ссылка на результат команды batch: передаётся без кодирования, чтобы Битрикс24 её подставил"""
+
+
+class BatchRequest:
+    """
+    Построитель batch-запроса к API Битрикс24
+    Команды выполняются за один HTTP-запрос, параметры могут ссылаться
+    на результаты предыдущих команд через ref()
+    """
+
+    MAX_COMMANDS = 50
+
+    def __init__(self, halt=False):
+        self.halt = halt
+        self.commands = {}
+
+    @staticmethod
+    def ref(name, *path):
+        """Ссылка на результат команды: $result[name][path...]"""
+        return _Ref(f"$result[{name}]" + ''.join(f"[{key}]" for key in path))
+
+    @classmethod
+    def _flatten(cls, params, prefix=''):
+        """Разворачивание вложенных параметров в ключи вида fields[NAME][0]"""
+        items = params.items() if isinstance(params, dict) else enumerate(params)
+        pairs = []
+        for key, value in items:
+            name = f"{prefix}[{key}]" if prefix else str(key)
+            if isinstance(value, (dict, list, tuple)):
+                pairs.extend(cls._flatten(value, name))
+            else:
+                pairs.append((name, value))
+        return pairs
+
+    @staticmethod
+    def _encode(value):
+        """
+        Значение параметра в строке команды: кодируется полностью, иначе текст вида $result[...]
+        из данных сделки или контакта Битрикс24 подставит как ссылку; ссылки ref() - как есть
+        """
+        if isinstance(value, _Ref):
+            return value
+        if isinstance(value, bool):
+            value = 'Y' if value else 'N'
+        elif value is None:
+            value = ''
+        return quote(str(value), safe='')
+
+    def add(self, name, method, params=None):
+        """Добавление команды под именем name"""
+        if len(self.commands) >= self.MAX_COMMANDS:
+            raise ValueError(f"Batch request is limited to {self.MAX_COMMANDS} commands")
+        query = '&'.join(
+            f"{quote(key, safe='[]')}={self._encode(value)}" for key, value in self._flatten(params or {})
+        )
+        self.commands[name] = f"{method}?{query}" if query else method
+        return self
+
+    def build(self):
+        """Параметры для метода batch"""
+        return {'halt': 1 if self.halt else 0, 'cmd': self.commands}
+
+
+class BaseBitrixAPI:
+    """
+    Общая часть синхронного и асинхронного клиентов: ход запроса с повторами, лимитом запросов
+    и автоматом отключения, разбор ответов и batch-запросов. Наследники задают только транспорт:
+    _post(), _acquire(), _sleep() и run_flow
+    """
+
+    run_flow = None
+
+    def __init__(self, webhook_url, rate_limiter=None, circuit_breaker=None, portal='default'):
+        self.webhook_url = webhook_url.rstrip('/')
+        # Имя портала для меток метрик
+        self.portal = portal
+        self.read_retries = int(os.getenv('BITRIX_READ_RETRIES', '2'))
+        self.retry_backoff = float(os.getenv('BITRIX_RETRY_BACKOFF', '0.5'))
+        self.rate_limiter = rate_limiter or RateLimiter(portal=portal)
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(portal=portal)
+
+    @staticmethod
+    def _parse_response(response):
+        """Разбор ответа: данные или ошибка в формате Битрикс24"""
+        try:
+            data = response.json()
+        except ValueError:
+            return error_result('INVALID_RESPONSE', f"HTTP {response.status_code}: non-JSON response")
+        if not isinstance(data, dict):
+            return error_result('INVALID_RESPONSE', f"HTTP {response.status_code}: unexpected response")
+        if response.status_code >= 400 and 'error' not in data:
+            return error_result('HTTP_ERROR', f"HTTP {response.status_code}")
+        return data
+
+    def _request_flow(self, method, params=None):
+        """Ход запроса к методу API (генератор для flow.run_flow)"""
+        url = f"{self.webhook_url}/{method}.json"
+        retries = self.read_retries if method.endswith(READ_METHOD_SUFFIXES) else 0
+        attempt = 0
+        throttled = 0
+        started = time.time()
+
+        while True:
+            # Пока портал недоступен, запрос завершается сразу, не занимая воркер ожиданием таймаута
+            if not self.circuit_breaker.allow():
+                data = error_result(CIRCUIT_OPEN, 'Bitrix24 is unavailable, circuit breaker is open')
+                observe_api_call(method, started, data, self.portal)
+                return data
+
+            yield partial(self._acquire, method)
+            attempt_started = time.time()
+            response, data = yield partial(self._post, url, params or {})
+            if response is None:
+                retryable = True
+                self.circuit_breaker.record(True, time.time() - attempt_started)
+            elif self.rate_limiter.check_throttled(method, response):
+                throttled += 1
+                if throttled <= self.rate_limiter.max_retries:
+                    continue
+                data, retryable = error_result(QUERY_LIMIT_EXCEEDED, 'Rate limit retries exhausted'), False
+            else:
+                data = self._parse_response(response)
+                retryable = response.status_code >= 500
+                self.circuit_breaker.record(retryable, time.time() - attempt_started)
+                if 'error' not in data:
+                    self.rate_limiter.observe(method, data)
+                    observe_api_call(method, started, data, self.portal)
+                    return data
+
+            if retryable and attempt < retries:
+                attempt += 1
+                yield partial(self._sleep, self.retry_backoff * 2 ** (attempt - 1))
+                continue
+
+            logger.error(f"API request {method} failed: {data['error']}: {data.get('error_description', '')}")
+            observe_api_call(method, started, data, self.portal)
+            return data
+
+    def _batch_flow(self, batch):
+        """Ход batch-запроса с разбором результатов по командам"""
+        data = yield from self._request_flow('batch', batch.build())
+        if not data or 'result' not in data:
+            return None
+        # Пустые результаты Битрикс24 возвращает списками, а не объектами
+        errors = data['result'].get('result_error') or {}
+        for error in errors.values():
+            code = error.get('error', 'UNKNOWN') if isinstance(error, dict) else 'UNKNOWN'
+            API_ERRORS.labels('batch', code, self.portal).inc()
+        return {
+            'result': data['result'].get('result') or {},
+            'errors': errors
+        }
+
+    def _make_request(self, method, params=None):
+        """
+        Выполнение запроса к API Битрикс24 с учётом общего лимита запросов
+        Возвращает ответ API; при ошибке - словарь с ключами error и error_description
+        """
+        return self.run_flow(self._request_flow(method, params))
+
+    def get_deal(self, deal_id):
+        """Получение сделки по ID"""
+        return self._make_request('crm.deal.get', {'ID': deal_id})
+
+    def update_deal(self, deal_id, fields):
+        """Обновление сделки"""
+        return self._make_request('crm.deal.update', {'ID': deal_id, 'fields': fields})
+
+    def call_batch(self, batch):
+        """
+        Выполнение batch-запроса
+        Возвращает {'result': {имя: результат}, 'errors': {имя: ошибка}} или None
+        """
+        return self.run_flow(self._batch_flow(batch))
+
+
+class BitrixAPI(BaseBitrixAPI):
+    """Класс для работы с API Битрикс24"""
+
+    run_flow = staticmethod(run_flow)
+
+    def __init__(self, webhook_url, user_agent='BitrixWebhookHandler/1.0', rate_limiter=None, circuit_breaker=None,
+                 portal='default'):
+        super().__init__(webhook_url, rate_limiter, circuit_breaker, portal)
+        self.timeout = (
+            float(os.getenv('BITRIX_CONNECT_TIMEOUT', '5')),
+            float(os.getenv('BITRIX_READ_TIMEOUT', '20'))
+        )
+
+        pool_size = int(os.getenv('BITRIX_POOL_SIZE', '10'))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            'User-Agent': user_agent
+        })
+
+    def _post(self, url, params):
+        """HTTP-запрос: (ответ, None) или (None, ошибка)"""
+        try:
+            return self.session.post(url, json=params, timeout=self.timeout), None
+        except requests.Timeout as e:
+            return None, error_result('TIMEOUT', str(e))
+        except requests.RequestException as e:
+            return None, error_result('CONNECTION_ERROR', str(e))
+
+    def _acquire(self, method):
+        """Ожидание права на запрос"""
+        self.rate_limiter.acquire(method)
+
+    _sleep = staticmethod(time.sleep)
+
+    def iter_list(self, method, filter=None, select=None, page_size=50, after_id=0, raise_errors=False):
+        """
+        Постраничная выборка списка по ID (генератор)
+        Фильтр >ID, сортировка по ID и start=-1, чтобы Битрикс24 не считал общее количество записей;
+        after_id - начать с записей, у которых ID больше; при ошибке API выборка прекращается
+        с записью в лог, а при raise_errors - исключением RuntimeError
+        """
+        last_id = int(after_id)
+        while True:
+            data = self._make_request(method, {
+                'filter': dict(filter or {}, **{'>ID': last_id}),
+                'select': select or ['*'],
+                'order': {'ID': 'ASC'},
+                'start': -1
+            })
+            if 'result' not in data:
+                logger.error(f"Failed to list {method} after ID {last_id}")
+                if raise_errors:
+                    raise RuntimeError(f"{method} failed: {data.get('error')}")
+                return
+
+            items = data['result']
+            yield from items
+            if len(items) < page_size:
+                return
+            last_id = int(items[-1]['ID'])
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Параллельная обработка потока элементов (например, постраничной выборки сделок) пулом потоков
+Следующие элементы читаются, только пока в работе не больше двух на поток, поэтому
+страницы списка не загружаются в память целиком. Используется CRON и сверкой
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def process_bounded(items, process, on_done, concurrency):
+    """
+    process(item) выполняется в пуле из concurrency потоков, on_done(item, success, error) -
+    в вызывающем потоке по мере завершения; error - исключение process() или None
+    """
+    in_flight = {}
+
+    def collect(future):
+        item = in_flight.pop(future)
+        try:
+            success, error = future.result(), None
+        except Exception as e:
+            success, error = False, e
+        on_done(item, success, error)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for item in items:
+            in_flight[executor.submit(process, item)] = item
+
+            # Не читаем следующие страницы, пока пул занят
+            if len(in_flight) >= concurrency * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+
+        for future in list(in_flight):
+            collect(future)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Автомат отключения (circuit breaker) для запросов к порталу Битрикс24
+Состояние хранится в файле SQLite, поэтому все процессы видят недоступность портала одновременно.
+После CIRCUIT_FAILURE_THRESHOLD сбоев подряд (сетевая ошибка, 5xx или ответ дольше
+CIRCUIT_SLOW_CALL_SECONDS) запросы сразу завершаются ошибкой CIRCUIT_OPEN; через CIRCUIT_OPEN_SECONDS
+один пробный запрос проверяет портал: успех закрывает автомат, сбой снова открывает его
+"""
+
+import os
+import time
+import logging
+from datetime import datetime
+
+from local_db import LocalDB
+from metrics import CIRCUIT_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS circuit (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL DEFAULT 0,
+    retry_at REAL NOT NULL DEFAULT 0,
+    changed_at REAL NOT NULL,
+    trips INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Ошибка клиента API, пока автомат открыт
+CIRCUIT_OPEN = 'CIRCUIT_OPEN'
+
+
+class CircuitBreaker:
+    """Автомат отключения: closed -> open -> half_open -> closed"""
+
+    def __init__(self, db_path=None, failure_threshold=None, slow_call_seconds=None, open_seconds=None,
+                 portal='default'):
+        self.db_path = db_path or os.getenv('CIRCUIT_DB_PATH', 'circuit_breaker.db')
+        self.failure_threshold = failure_threshold or int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+        self.slow_call_seconds = slow_call_seconds or float(os.getenv('CIRCUIT_SLOW_CALL_SECONDS', '10'))
+        self.open_seconds = open_seconds or float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))
+        # Имя портала для меток метрик
+        self.portal = portal
+        self.db = LocalDB(self.db_path, SCHEMA)
+        self.db.conn().execute(
+            'INSERT OR IGNORE INTO circuit (id, state, changed_at) VALUES (1, ?, ?)', (CLOSED, time.time())
+        )
+
+    def _read(self, conn=None):
+        return (conn or self.db.conn()).execute(
+            'SELECT state, failures, retry_at, changed_at, trips FROM circuit WHERE id = 1'
+        ).fetchone()
+
+    def _transition(self, conn, state, **fields):
+        """Смена состояния с учётом в метриках"""
+        fields.update(state=state, changed_at=time.time())
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        conn.execute(f"UPDATE circuit SET {assignments} WHERE id = 1", list(fields.values()))
+        CIRCUIT_TRANSITIONS.labels(self.portal, state).inc()
+
+    def is_open(self):
+        """Открыт ли автомат сейчас (без захвата пробного запроса)"""
+        state, _, retry_at, _, _ = self._read()
+        return state != CLOSED and retry_at > time.time()
+
+    def allow(self):
+        """
+        Можно ли выполнить запрос
+        В закрытом состоянии - всегда, в открытом - нет; по истечении паузы право на пробный
+        запрос получает один вызов, остальные ждут его результата до следующей паузы
+        """
+        state, _, retry_at, _, _ = self._read()
+        if state == CLOSED:
+            return True
+        now = time.time()
+        if retry_at > now:
+            return False
+
+        with self.db.transaction() as conn:
+            state, _, retry_at, _, _ = self._read(conn)
+            if state == CLOSED:
+                return True
+            if retry_at > now:
+                return False
+            self._transition(conn, HALF_OPEN, retry_at=now + self.open_seconds)
+        logger.info(f"Circuit breaker of portal {self.portal} is half-open, sending a trial request")
+        return True
+
+    def record(self, failed, elapsed):
+        """Учёт результата запроса: failed - сетевая ошибка или 5xx; медленный ответ тоже считается сбоем"""
+        if failed or elapsed >= self.slow_call_seconds:
+            self._failure()
+        else:
+            self._success()
+
+    def _success(self):
+        state, failures, _, _, _ = self._read()
+        if state == CLOSED and not failures:
+            return
+        with self.db.transaction() as conn:
+            state, _, _, _, _ = self._read(conn)
+            if state == CLOSED:
+                conn.execute('UPDATE circuit SET failures = 0 WHERE id = 1')
+                return
+            self._transition(conn, CLOSED, failures=0, retry_at=0)
+        logger.info(f"Circuit breaker of portal {self.portal} closed, Bitrix24 is available again")
+
+    def _failure(self):
+        now = time.time()
+        with self.db.transaction() as conn:
+            state, failures, _, _, trips = self._read(conn)
+            failures += 1
+            if state == OPEN or (state == CLOSED and failures < self.failure_threshold):
+                conn.execute('UPDATE circuit SET failures = ? WHERE id = 1', (failures,))
+                return
+            self._transition(conn, OPEN, failures=failures, retry_at=now + self.open_seconds, trips=trips + 1)
+        logger.warning(f"Circuit breaker of portal {self.portal} opened after {failures} failures, "
+                       f"requests fail fast for {self.open_seconds:.0f}s")
+
+    def stats(self):
+        """Состояние автомата для /health"""
+        state, failures, retry_at, changed_at, trips = self._read()
+        return {
+            'state': state,
+            'failures': failures,
+            'retry_in': round(max(retry_at - time.time(), 0), 3) if state != CLOSED else 0,
+            'since': datetime.fromtimestamp(changed_at).isoformat(timespec='seconds'),
+            'trips': trips
+        }
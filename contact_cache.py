@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кэш в памяти процесса
+LRU с ограничением размера и временем жизни записей
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с временем жизни записей"""
+
+    def __init__(self, max_size=1000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Значение по ключу или default"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if time.time() - entry[1] > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, stored_at=None):
+        """
+        Сохранение значения
+        stored_at - момент, на который значение актуально (по умолчанию сейчас)
+        """
+        with self._lock:
+            self._data[key] = (value, stored_at or time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Удаление записи"""
+        with self._lock:
+            self._data.pop(key, None)
+
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальная копия причин отказов контактов (SQLite)
+Заполняется инкрементальной синхронизацией crm.contact.list по DATE_MODIFY (contact_sync.py)
+и при обращениях к API; событие ONCRMCONTACTUPDATE помечает запись устаревшей во всех процессах.
+Без событий и синхронизации запись действительна не дольше CONTACT_STORE_MAX_AGE секунд
+"""
+
+import os
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+
+from local_db import LocalDB
+from metrics import CONTACT_CACHE
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    contact_id INTEGER PRIMARY KEY,
+    reasons TEXT,
+    date_modify TEXT,
+    updated_at REAL NOT NULL DEFAULT 0,
+    invalidated_at REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class ContactStore:
+    """
+    Причины отказов по ID контакта
+    Запись действительна, если получена позже последней инвалидации и не старше max_age;
+    недавняя синхронизация подтверждает все записи на момент своего начала
+    """
+
+    def __init__(self, db_path=None, overlap_minutes=None, portal='default', max_age=None):
+        self.db_path = db_path or os.getenv('CONTACT_STORE_DB_PATH', 'contact_store.db')
+        # Запас по DATE_MODIFY на расхождение часов и изменения, записанные с задержкой
+        self.overlap = timedelta(minutes=overlap_minutes or int(os.getenv('CONTACT_SYNC_OVERLAP_MINUTES', '5')))
+        self.max_age = max_age or float(os.getenv('CONTACT_STORE_MAX_AGE', '300'))
+        self.db = LocalDB(self.db_path, SCHEMA)
+        # Имя портала для меток метрик
+        self.portal = portal
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Причины отказов контакта или default, если записи нет или она устарела"""
+        row = self.db.conn().execute(
+            'SELECT reasons FROM contacts WHERE contact_id = ? AND reasons IS NOT NULL '
+            'AND updated_at > invalidated_at '
+            "AND MAX(updated_at, COALESCE((SELECT CAST(value AS REAL) FROM sync_state WHERE name = 'synced_at'), 0)) >= ?",
+            (int(key), time.time() - self.max_age)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            CONTACT_CACHE.labels('miss', self.portal).inc()
+            return default
+        self.hits += 1
+        CONTACT_CACHE.labels('hit', self.portal).inc()
+        return json.loads(row[0])
+
+    def put(self, key, value, stored_at=None, date_modify=None):
+        """
+        Сохранение причин отказов
+        stored_at - момент, на который данные актуальны; более старые данные не перезаписывают новые
+        """
+        self.put_many([(key, value, date_modify)], stored_at)
+
+    def put_many(self, rows, stored_at=None):
+        """Сохранение списка (ID контакта, причины, DATE_MODIFY)"""
+        stored_at = stored_at or time.time()
+        self.db.conn().executemany(
+            'INSERT INTO contacts (contact_id, reasons, date_modify, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (contact_id) DO UPDATE SET reasons = excluded.reasons, '
+            'date_modify = COALESCE(excluded.date_modify, date_modify), updated_at = excluded.updated_at '
+            'WHERE excluded.updated_at >= contacts.updated_at',
+            [(int(key), json.dumps(value, ensure_ascii=False), date_modify, stored_at)
+             for key, value, date_modify in rows]
+        )
+
+    def invalidate(self, key):
+        """Пометка записи устаревшей для всех процессов"""
+        self.db.conn().execute(
+            'INSERT INTO contacts (contact_id, invalidated_at) VALUES (?, ?) '
+            'ON CONFLICT (contact_id) DO UPDATE SET invalidated_at = excluded.invalidated_at',
+            (int(key), time.time())
+        )
+
+    def _state(self, name):
+        row = self.db.conn().execute('SELECT value FROM sync_state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, name, value):
+        self.db.conn().execute('INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)', (name, value))
+
+    def is_synced(self):
+        """Выполнена ли хотя бы одна полная синхронизация"""
+        return self._state('date_modify') is not None
+
+    @staticmethod
+    def latest_date_modify(api):
+        """Наибольший DATE_MODIFY контактов портала - время портала на начало прохода"""
+        data = api._make_request('crm.contact.list', {
+            'order': {'DATE_MODIFY': 'DESC'},
+            'select': ['ID', 'DATE_MODIFY'],
+            'start': -1
+        })
+        if 'result' not in data:
+            raise RuntimeError(f"crm.contact.list failed: {data.get('error')}")
+        dates = [contact['DATE_MODIFY'] for contact in data['result'][:1] if contact.get('DATE_MODIFY')]
+        return datetime.fromisoformat(dates[0]) if dates else None
+
+    def sync(self, api, reasons_field, extract):
+        """
+        Инкрементальная синхронизация: контакты с DATE_MODIFY не раньше отметки (с запасом)
+        Первый запуск загружает все контакты. extract(contact) - разбор причин отказов.
+        Новая отметка - наибольший DATE_MODIFY до начала выборки: контакт, изменённый во время долгого
+        прохода после того, как выборка прошла его ID, попадёт в следующий проход.
+        Отметка сдвигается только после успешной выборки; возвращает число загруженных контактов
+        """
+        watermark = self._state('date_modify')
+        filter = {}
+        if watermark:
+            filter['>=DATE_MODIFY'] = (datetime.fromisoformat(watermark) - self.overlap).isoformat(timespec='seconds')
+
+        started = time.time()
+        newest = self.latest_date_modify(api) or (datetime.fromisoformat(watermark) if watermark else None)
+        rows = []
+        count = 0
+        for contact in api.iter_list('crm.contact.list', filter=filter,
+                                     select=['ID', 'DATE_MODIFY', reasons_field], raise_errors=True):
+            rows.append((contact['ID'], extract(contact), contact.get('DATE_MODIFY')))
+            if len(rows) >= 500:
+                self.put_many(rows, started)
+                count += len(rows)
+                rows = []
+        if rows:
+            self.put_many(rows, started)
+            count += len(rows)
+
+        self._set_state('date_modify', (newest or datetime.now().astimezone()).isoformat(timespec='seconds'))
+        self._set_state('synced_at', str(started))
+        return count
+
+    def stats(self):
+        """Статистика локальной копии"""
+        total = self.hits + self.misses
+        synced_at = self._state('synced_at')
+        return {
+            'contacts': self.db.conn().execute('SELECT COUNT(*) FROM contacts').fetchone()[0],
+            'synced_at': datetime.fromtimestamp(float(synced_at)).isoformat(timespec='seconds') if synced_at else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else None
+        }
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Синхронизация локальной копии контактов (contact_store.py) с Битрикс24
+Первый проход загружает все контакты, следующие - только изменённые после отметки DATE_MODIFY
+Каждый портал синхронизируется в своём потоке
+"""
+
+import os
+import signal
+import logging
+import threading
+
+from app import deal_processors
+from priority import PRIORITY_BACKGROUND, set_default_priority
+
+logger = logging.getLogger('contact_sync')
+
+
+def sync_loop(name, processor, interval, stop_event):
+    """Цикл синхронизации одного портала"""
+    while not stop_event.is_set():
+        try:
+            count = processor.sync_contacts()
+            logger.info(f"Contact sync of {name}: {count} contacts loaded, "
+                        f"{processor.contact_store.stats()['contacts']} in store")
+        except Exception as e:
+            logger.error(f"Contact sync of {name} failed: {e}")
+        stop_event.wait(interval)
+
+
+def main():
+    """Основная функция"""
+    # Синхронизация контактов не задерживает обработку событий
+    set_default_priority(PRIORITY_BACKGROUND)
+    if not deal_processors:
+        logger.error("BITRIX_WEBHOOK_URL or PORTALS_CONFIG not configured")
+        return
+
+    interval = float(os.getenv('CONTACT_SYNC_INTERVAL', '60'))
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+    logger.info(f"Contact sync started for {len(deal_processors)} portals, interval {interval:.0f}s")
+    threads = [
+        threading.Thread(target=sync_loop, args=(name, processor, interval, stop_event), name=f"contact-sync-{name}")
+        for name, processor in deal_processors.items()
+    ]
+    for thread in threads:
+        thread.start()
+    # Ожидание с таймаутом, чтобы главный поток получал сигналы
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+    logger.info("Contact sync stopped")
+
+
+if __name__ == '__main__':
+    main()
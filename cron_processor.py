@@ -7,194 +7,134 @@ CRON-процессор для Битрикс24
 
 import os
 import json
+import time
 import logging
-import requests
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 
+from app import deal_processors
+from bounded_pool import process_bounded
+from cron_state import CronState
+from deal_queue import DealQueue
+from log_setup import setup_logging
+from portals import DEFAULT_PORTAL
+from priority import PRIORITY_BACKGROUND, set_default_priority
+
 # Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/bitrix_cron.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging('/var/log/bitrix_cron.log', 'CRON_LOG_FILE')
 logger = logging.getLogger(__name__)
 
-class BitrixAPI:
-    """Класс для работы с API Битрикс24"""
+def get_recent_deals(api_client, hours=3, page_size=50, since=None):
+    """
+    Получение недавно созданных сделок (генератор)
+    Постраничная выборка по ID - BitrixAPI.iter_list; при ошибке API выборка прекращается
+    """
+    # Получаем сделки начиная с since, по умолчанию за последние 3 часа
+    since = since or datetime.now().astimezone() - timedelta(hours=hours)
+    return api_client.iter_list(
+        'crm.deal.list',
+        filter={
+            '>DATE_CREATE': since.isoformat(timespec='seconds'),
+            'STAGE_ID': 'NEW'  # Только новые сделки
+        },
+        select=['ID', 'TITLE', 'CONTACT_ID', 'DATE_CREATE'],
+        page_size=page_size
+    )
+
+def process_deals(processor, deals, state, concurrency=4, retry_queue=None, portal=DEFAULT_PORTAL):
+    """
+    Параллельная обработка сделок пулом потоков
+    Частоту запросов ограничивает общий RateLimiter клиента API; неудачные сделки
+    передаются в retry_queue (повторы выполняет queue_worker.py), если она задана.
+    Возвращает сводку по запуску с результатами и ошибками по сделкам
+    """
+    summary = {'found': 0, 'processed': [], 'retried': [], 'failed': [], 'errors': {}, 'dates': {}}
+    started = time.time()
     
-    def __init__(self, webhook_url):
-        self.webhook_url = webhook_url.rstrip('/')
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'User-Agent': 'BitrixCronProcessor/1.0'
-        })
+    def pending():
+        for deal in deals:
+            if state.is_processed(deal['ID']):
+                continue
+            summary['found'] += 1
+            summary['dates'][deal['ID']] = datetime.fromisoformat(deal['DATE_CREATE'])
+            logger.info(f"Processing recent deal {deal['ID']}: {deal['TITLE']}")
+            yield deal['ID']
     
-    def _make_request(self, method, params=None):
-        """Выполнение запроса к API Битрикс24"""
-        url = f"{self.webhook_url}/{method}.json"
-        try:
-            response = self.session.post(url, json=params or {})
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            logger.error(f"API request failed: {e}")
-            return None
+    def collect(deal_id, success, error):
+        if error:
+            summary['errors'][deal_id] = str(error)
+        if success:
+            summary['processed'].append(deal_id)
+            state.mark_processed(deal_id)
+        elif retry_queue:
+            retry_queue.schedule_retry(deal_id, 'ONCRMDEALADD', portal)
+            summary['retried'].append(deal_id)
+            state.mark_processed(deal_id)
+        else:
+            summary['failed'].append(deal_id)
     
-    def get_deal(self, deal_id):
-        """Получение сделки по ID"""
-        return self._make_request('crm.deal.get', {'ID': deal_id})
+    process_bounded(pending(), processor.process_new_deal, collect, concurrency)
     
-    def update_deal(self, deal_id, fields):
-        """Обновление сделки"""
-        return self._make_request('crm.deal.update', {'ID': deal_id, 'fields': fields})
+    summary['elapsed'] = time.time() - started
+    summary['throughput'] = len(summary['processed']) / summary['elapsed'] if summary['elapsed'] else 0.0
+    return summary
 
-class DealProcessor:
-    """Процессор для обработки сделок"""
+def process_portal(processor, concurrency, retry_queue, hours=3):
+    """Один запуск CRON для портала процессора; отметка и обработанные сделки - в файле состояния портала"""
+    portal = processor.portal.name
+    state = CronState(db_path=processor.portal.db_path('cron_state.db'))
     
-    def __init__(self, api_client):
-        self.api = api_client
-        self.rejection_history_field = 'UF_CRM_1755175908229'  # Поле истории отказов
-        self.max_field_length = 2000
+    # Выбираем только сделки после сохранённой отметки
+    since = state.get_since(hours)
+    logger.info(f"Looking for deals of portal {portal} created after {since.isoformat(timespec='seconds')}")
     
-    def get_contact_rejection_reasons(self, contact_id):
-        """Получение причин отказов из поля контакта"""
-        try:
-            # Получаем контакт
-            contact_data = self.api._make_request('crm.contact.get', {'ID': contact_id})
-            if not contact_data or 'result' not in contact_data:
-                return []
-            
-            contact = contact_data['result']
-            rejection_field = contact.get('UF_CRM_1755175983293', '')
-            
-            if not rejection_field:
-                return []
-            
-            # Если это строка, разбиваем по переносам строк
-            if isinstance(rejection_field, str):
-                reasons = [line.strip() for line in rejection_field.split('\n') if line.strip()]
-            else:
-                reasons = [str(rejection_field).strip()]
-            
-            return [r for r in reasons if r]
-            
-        except Exception as e:
-            logger.error(f"Error getting contact rejection reasons: {e}")
-            return []
+    summary = process_deals(
+        processor, get_recent_deals(processor.api, since=since), state, concurrency, retry_queue, portal
+    )
     
-    def process_deal(self, deal_id):
-        """Обработка конкретной сделки"""
-        try:
-            logger.info(f"Processing deal {deal_id}")
-            
-            # Получаем сделку
-            deal_data = self.api.get_deal(deal_id)
-            if not deal_data or 'result' not in deal_data:
-                logger.error(f"Failed to get deal {deal_id}")
-                return False
-            
-            deal = deal_data['result']
-            contact_id = deal.get('CONTACT_ID')
-            
-            if not contact_id:
-                logger.warning(f"Deal {deal_id} has no contact")
-                return False
-            
-            logger.info(f"Processing deal {deal_id} for contact {contact_id}")
-            
-            # Получаем причины отказов из поля контакта
-            rejection_reasons = self.get_contact_rejection_reasons(contact_id)
-            logger.info(f"Found {len(rejection_reasons)} rejection reasons in contact {contact_id}")
-            
-            if not rejection_reasons:
-                logger.info(f"No rejection reasons found for contact {contact_id}")
-                return True
-            
-            # Формируем текст для поля истории
-            history_text = "Предыдущие причины отказов:\n"
-            for i, reason in enumerate(rejection_reasons, 1):
-                history_text += f"{i}. {reason}\n"
-            
-            # Обрезаем до максимальной длины
-            if len(history_text) > self.max_field_length:
-                history_text = history_text[:self.max_field_length-3] + "..."
-            
-            # Обновляем сделку
-            update_result = self.api.update_deal(deal_id, {
-                self.rejection_history_field: [history_text]
-            })
-            
-            if update_result and update_result.get('result'):
-                logger.info(f"Successfully updated deal {deal_id} with {len(rejection_reasons)} rejection reasons")
-                return True
-            else:
-                logger.error(f"Failed to update deal {deal_id}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error processing deal {deal_id}: {e}")
-            return False
-
-def get_recent_deals(api_client, hours=3):
-    """Получение недавно созданных сделок"""
-    try:
-        # Получаем сделки за последние 3 часа
-        since = datetime.now() - timedelta(hours=hours)
-        since_str = since.strftime('%Y-%m-%d %H:%M:%S')
-        
-        result = api_client._make_request('crm.deal.list', {
-            'filter': {
-                '>DATE_CREATE': since_str,
-                'STAGE_ID': 'NEW'  # Только новые сделки
-            },
-            'select': ['ID', 'TITLE', 'CONTACT_ID', 'DATE_CREATE'],
-            'order': {'DATE_CREATE': 'DESC'},
-            'start': 0
-        })
-        
-        if result and 'result' in result:
-            return result['result']
-        return []
-        
-    except Exception as e:
-        logger.error(f"Error getting recent deals: {e}")
-        return []
+    newest_date = max((summary['dates'][i] for i in summary['processed'] + summary['retried']), default=None)
+    oldest_failed_date = min((summary['dates'][i] for i in summary['failed']), default=None)
+    
+    # Отметку не сдвигаем дальше неудачных сделок, чтобы они попали в следующий запуск
+    watermark = oldest_failed_date or newest_date
+    if watermark:
+        state.set_watermark(watermark)
+    state.prune(hours * 3600)
+    
+    for deal_id, error in summary['errors'].items():
+        logger.error(f"Deal {deal_id} of portal {portal} failed: {error}")
+    logger.info(
+        f"Portal {portal}: {len(summary['processed'])} of {summary['found']} deals processed, "
+        f"{len(summary['retried'])} scheduled for retry, {len(summary['failed'])} failed in {summary['elapsed']:.1f}s "
+        f"({summary['throughput']:.2f} deals/s, concurrency {concurrency})"
+    )
+    return summary
 
 def main():
     """Основная функция"""
+    set_default_priority(PRIORITY_BACKGROUND)
     try:
         logger.info("=== CRON PROCESSOR STARTED ===")
         
-        # Инициализация API
-        webhook_url = os.getenv('BITRIX_WEBHOOK_URL')
-        if not webhook_url:
-            logger.error("BITRIX_WEBHOOK_URL not configured")
+        # Процессоры вебхука: пропуск неизменной истории, журнал своих записей и блокировки сделок
+        # в файлах состояния своего портала
+        if not deal_processors:
+            logger.error("BITRIX_WEBHOOK_URL or PORTALS_CONFIG not configured")
             return
         
-        api = BitrixAPI(webhook_url)
-        processor = DealProcessor(api)
-        
-        # Получаем недавние сделки
-        recent_deals = get_recent_deals(api, hours=3)
-        logger.info(f"Found {len(recent_deals)} recent deals")
-        
-        processed_count = 0
-        for deal in recent_deals:
-            deal_id = deal['ID']
-            logger.info(f"Processing recent deal {deal_id}: {deal['TITLE']}")
-            
-            if processor.process_deal(deal_id):
-                processed_count += 1
+        concurrency = int(os.getenv('CRON_CONCURRENCY', '4'))
+        retry_queue = DealQueue()
+        processed = found = 0
+        for processor in deal_processors.values():
+            summary = process_portal(processor, concurrency, retry_queue)
+            processed += len(summary['processed'])
+            found += summary['found']
         
-        logger.info(f"=== CRON PROCESSOR COMPLETED: {processed_count} deals processed ===")
+        logger.info(f"=== CRON PROCESSOR COMPLETED: {processed} of {found} deals processed "
+                    f"on {len(deal_processors)} portals ===")
         
     except Exception as e:
         logger.error(f"CRON processor error: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
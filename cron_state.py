@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Состояние CRON-процессора между запусками
+Отметка (watermark) по DATE_CREATE и множество уже обработанных сделок,
+чтобы каждый запуск выбирал только новые сделки
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+from local_db import LocalDB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermark (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processed_deals (
+    deal_id INTEGER PRIMARY KEY,
+    processed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_processed_deals_at ON processed_deals (processed_at);
+"""
+
+
+class CronState:
+    """Отметка последней обработанной сделки и множество обработанных сделок"""
+
+    def __init__(self, db_path=None, overlap_minutes=None):
+        self.db_path = db_path or os.getenv('CRON_STATE_DB_PATH', 'cron_state.db')
+        # Запас на расхождение часов и сделки, которые появились в выборке с задержкой
+        self.overlap = timedelta(minutes=overlap_minutes or int(os.getenv('CRON_OVERLAP_MINUTES', '10')))
+        self.db = LocalDB(self.db_path, SCHEMA)
+
+    def get_since(self, hours):
+        """Начало выборки: отметка минус запас, но не раньше чем hours назад"""
+        floor = datetime.now().astimezone() - timedelta(hours=hours)
+        row = self.db.conn().execute("SELECT value FROM watermark WHERE name = 'date_create'").fetchone()
+        if not row:
+            return floor
+        return max(datetime.fromisoformat(row[0]) - self.overlap, floor)
+
+    def set_watermark(self, date_create):
+        """Сохранение отметки по DATE_CREATE"""
+        self.db.conn().execute(
+            "INSERT OR REPLACE INTO watermark (name, value) VALUES ('date_create', ?)",
+            (date_create.isoformat(),)
+        )
+
+    def is_processed(self, deal_id):
+        """Была ли сделка уже обработана"""
+        row = self.db.conn().execute(
+            'SELECT 1 FROM processed_deals WHERE deal_id = ?', (int(deal_id),)
+        ).fetchone()
+        return row is not None
+
+    def mark_processed(self, deal_id):
+        """Отметка сделки как обработанной"""
+        self.db.conn().execute(
+            'INSERT OR REPLACE INTO processed_deals (deal_id, processed_at) VALUES (?, ?)',
+            (int(deal_id), time.time())
+        )
+
+    def prune(self, max_age_seconds):
+        """Удаление отметок о сделках, вышедших за окно выборки"""
+        self.db.conn().execute(
+            'DELETE FROM processed_deals WHERE processed_at < ?', (time.time() - max_age_seconds,)
+        )
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Просмотр и повтор задач, исчерпавших попытки (таблица dead_letters очереди deal_queue.py)
+Повтор возвращает задачи в очередь пачками с паузой, чтобы не перегрузить обработчики и лимит запросов
+
+Примеры:
+    python3 dead_letters.py stats
+    python3 dead_letters.py list --portal main --limit 20
+    python3 dead_letters.py replay --portal main --batch-size 50 --pause 5
+    python3 dead_letters.py replay --id 17 --id 18
+    python3 dead_letters.py purge --older-than-days 30
+"""
+
+import time
+import argparse
+from datetime import datetime
+
+from deal_queue import DealQueue
+
+
+def format_time(timestamp):
+    """Время в читаемом виде"""
+    return datetime.fromtimestamp(timestamp).isoformat(sep=' ', timespec='seconds')
+
+
+def show_stats(queue, args):
+    """Число задач в очереди, в ожидании повтора и в dead_letters по порталам"""
+    stats = queue.stats()
+    print(f"{'portal':<24}{'queued':>10}{'retrying':>10}{'dead':>10}")
+    for portal, portal_stats in sorted(stats['portals'].items()):
+        print(f"{portal:<24}{portal_stats['depth']:>10}{portal_stats['retrying']:>10}{portal_stats['dead_letters']:>10}")
+    print(f"Retries scheduled: {stats['retries_scheduled']}, moved to dead letters: {stats['dead_lettered']}")
+
+
+def show_list(queue, args):
+    """Список задач из dead_letters"""
+    jobs = queue.dead_letters(args.portal, args.limit)
+    if not jobs:
+        print("No dead letters")
+        return
+    print(f"{'id':>8}  {'portal':<16}{'deal':>10}  {'event':<18}{'attempts':>9}{'events':>8}  failed at")
+    for job in jobs:
+        print(f"{job['id']:>8}  {job['portal']:<16}{job['deal_id']:>10}  {job['event']:<18}"
+              f"{job['attempts']:>9}{job['events']:>8}  {format_time(job['failed_at'])}")
+
+
+def replay(queue, args):
+    """Возврат задач в очередь пачками"""
+    total = 0
+    if args.id:
+        for start in range(0, len(args.id), args.batch_size):
+            if start:
+                time.sleep(args.pause)
+            total += queue.replay(args.id[start:start + args.batch_size])
+            print(f"Replayed {total} of {len(args.id)}")
+    else:
+        while not args.limit or total < args.limit:
+            batch_size = min(args.batch_size, args.limit - total) if args.limit else args.batch_size
+            jobs = queue.dead_letters(args.portal, batch_size)
+            if not jobs:
+                break
+            if total:
+                time.sleep(args.pause)
+            total += queue.replay([job['id'] for job in jobs])
+            print(f"Replayed {total}")
+    print(f"Done: {total} jobs returned to the queue")
+
+
+def purge(queue, args):
+    """Удаление старых задач из dead_letters"""
+    before = time.time() - args.older_than_days * 86400
+    print(f"Purged {queue.purge_dead_letters(before, args.portal)} dead letters")
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Просмотр и повтор задач, исчерпавших попытки')
+    parser.add_argument('--db', help='файл очереди (по умолчанию QUEUE_DB_PATH)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('stats', help='сводка по порталам').set_defaults(handler=show_stats)
+
+    list_parser = commands.add_parser('list', help='список задач')
+    list_parser.add_argument('--portal', help='только задачи портала')
+    list_parser.add_argument('--limit', type=int, default=100, help='сколько задач показать')
+    list_parser.set_defaults(handler=show_list)
+
+    replay_parser = commands.add_parser('replay', help='вернуть задачи в очередь')
+    replay_parser.add_argument('--portal', help='только задачи портала')
+    replay_parser.add_argument('--id', type=int, action='append', help='ID задачи (можно несколько раз)')
+    replay_parser.add_argument('--limit', type=int, default=0, help='сколько задач вернуть (0 - все)')
+    replay_parser.add_argument('--batch-size', type=int, default=50, help='задач в пачке')
+    replay_parser.add_argument('--pause', type=float, default=5, help='пауза между пачками, сек')
+    replay_parser.set_defaults(handler=replay)
+
+    purge_parser = commands.add_parser('purge', help='удалить старые задачи')
+    purge_parser.add_argument('--older-than-days', type=float, required=True, help='возраст задач, дней')
+    purge_parser.add_argument('--portal', help='только задачи портала')
+    purge_parser.set_defaults(handler=purge)
+
+    args = parser.parse_args()
+    args.handler(DealQueue(db_path=args.db), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Индекс обработанных сделок: ID сделки -> (контакт, хэш текста истории, версия причин отказов контакта)
+По нему ONCRMDEALUPDATE, который не может изменить поле истории, отбрасывается без запросов к API
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from local_db import LocalDB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deal_index (
+    deal_id INTEGER PRIMARY KEY,
+    contact_id INTEGER NOT NULL,
+    history_hash TEXT,
+    reasons_version TEXT NOT NULL,
+    checked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deal_index_checked_at ON deal_index (checked_at);
+"""
+
+
+def reasons_version(reasons):
+    """Версия набора причин отказов - хэш его содержимого"""
+    return hashlib.sha1(json.dumps(reasons, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def history_hash(history_text):
+    """Хэш текста истории; None, если текст не записывается"""
+    if history_text is None:
+        return None
+    return hashlib.sha1(history_text.strip().encode('utf-8')).hexdigest()[:16]
+
+
+class DealIndex:
+    """
+    Состояние сделок после последней обработки
+    Запись старше ttl не используется: сделка проверяется через API заново.
+    Срок короткий: смену контакта или очистку поля истории менеджером по событию не видно,
+    а сверка находит только сделки с пустым полем истории
+    """
+
+    def __init__(self, db_path=None, ttl=None):
+        self.db_path = db_path or os.getenv('DEAL_INDEX_DB_PATH', 'deal_index.db')
+        self.ttl = ttl or int(os.getenv('DEAL_INDEX_TTL', '60'))
+        self.db = LocalDB(self.db_path, SCHEMA)
+        self.pruned_at = 0.0
+
+    def get(self, deal_id):
+        """Запись по сделке: (контакт, хэш истории, версия причин) или None"""
+        row = self.db.conn().execute(
+            'SELECT contact_id, history_hash, reasons_version FROM deal_index WHERE deal_id = ? AND checked_at > ?',
+            (int(deal_id), time.time() - self.ttl)
+        ).fetchone()
+        return row
+
+    def record(self, deal_id, contact_id, history_text, reasons):
+        """Сохранение состояния сделки после обработки"""
+        now = time.time()
+        self.db.conn().execute(
+            'INSERT OR REPLACE INTO deal_index (deal_id, contact_id, history_hash, reasons_version, checked_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (int(deal_id), int(contact_id), history_hash(history_text), reasons_version(reasons), now)
+        )
+        # Устаревшие записи удаляются и без сверки, но не чаще раза за ttl
+        if now - self.pruned_at >= self.ttl:
+            self.pruned_at = now
+            self.prune()
+
+    def forget(self, deal_id):
+        """Удаление записи: следующее событие сделки обрабатывается полностью"""
+        self.db.conn().execute('DELETE FROM deal_index WHERE deal_id = ?', (int(deal_id),))
+
+    def prune(self):
+        """Удаление устаревших записей"""
+        self.db.conn().execute('DELETE FROM deal_index WHERE checked_at < ?', (time.time() - self.ttl,))
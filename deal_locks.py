@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Блокировки сделок, общие для всех процессов (SQLite)
+Сделку обрабатывает один процесс: воркеры gunicorn, queue_worker.py, CRON и сверка не выполняют
+одни и те же запросы к API и не пишут в сделку одновременно. Событие, пришедшее во время обработки,
+не ждёт блокировку: владелец после завершения обрабатывает сделку ещё раз, сколько бы событий ни пришло.
+Блокировка - аренда на DEAL_LOCK_TTL секунд, поэтому упавший процесс не держит сделку
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+
+from local_db import LocalDB
+from metrics import DEAL_LOCKS
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deal_locks (
+    deal_id INTEGER PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    rerun INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class DealLocks:
+    """Аренда сделок с запросом повторной обработки"""
+
+    def __init__(self, db_path=None, ttl=None, portal='default'):
+        self.db_path = db_path or os.getenv('DEAL_LOCKS_DB_PATH', 'deal_locks.db')
+        self.ttl = ttl or float(os.getenv('DEAL_LOCK_TTL', '120'))
+        # Имя портала для меток метрик
+        self.portal = portal
+        self.db = LocalDB(self.db_path, SCHEMA)
+
+    def acquire(self, deal_id):
+        """
+        Захват сделки, возвращает токен владельца
+        Если сделка занята, владельцу передаётся запрос повторной обработки и возвращается None
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT expires_at FROM deal_locks WHERE deal_id = ?', (int(deal_id),)).fetchone()
+            if row and row[0] > now:
+                conn.execute('UPDATE deal_locks SET rerun = 1 WHERE deal_id = ?', (int(deal_id),))
+                DEAL_LOCKS.labels('busy', self.portal).inc()
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                'INSERT OR REPLACE INTO deal_locks (deal_id, token, expires_at, rerun) VALUES (?, ?, ?, 0)',
+                (int(deal_id), token, now + self.ttl)
+            )
+        DEAL_LOCKS.labels('acquired', self.portal).inc()
+        return token
+
+    def release(self, deal_id, token, keep_for_rerun=True):
+        """
+        Освобождение сделки
+        Если за время обработки запрошен повтор, блокировка продлевается и возвращается False
+        """
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT token, rerun FROM deal_locks WHERE deal_id = ?', (int(deal_id),)).fetchone()
+            if not row or row[0] != token:
+                # Аренда истекла и сделку забрал другой процесс - повтор за ним
+                return True
+            if row[1] and keep_for_rerun:
+                conn.execute(
+                    'UPDATE deal_locks SET rerun = 0, expires_at = ? WHERE deal_id = ?',
+                    (time.time() + self.ttl, int(deal_id))
+                )
+                DEAL_LOCKS.labels('rerun', self.portal).inc()
+                return False
+            conn.execute('DELETE FROM deal_locks WHERE deal_id = ?', (int(deal_id),))
+        return True
+
+    def run(self, deal_id, process, rerun=None):
+        """
+        Выполнение process() под блокировкой сделки, повторы - через rerun() (по умолчанию process)
+        Возвращает результат последнего выполнения; если сделка занята - True: её обработает владелец
+        """
+        token = self.acquire(deal_id)
+        if not token:
+            logger.info(f"Deal {deal_id} is being processed by another worker, rerun requested")
+            return True
+
+        released = False
+        try:
+            result = process()
+            while not self.release(deal_id, token):
+                logger.info(f"Deal {deal_id} changed during processing, processing again")
+                result = (rerun or process)()
+            released = True
+            return result
+        finally:
+            if not released:
+                self.release(deal_id, token, keep_for_rerun=False)
+
+    async def run_async(self, deal_id, process, rerun=None):
+        """
+        То же, что run(), для корутин: process и rerun возвращают awaitable
+        Запросы к SQLite идут в потоке, чтобы ожидание блокировки базы не останавливало цикл событий
+        """
+        token = await asyncio.to_thread(self.acquire, deal_id)
+        if not token:
+            logger.info(f"Deal {deal_id} is being processed by another worker, rerun requested")
+            return True
+
+        released = False
+        try:
+            result = await process()
+            while not await asyncio.to_thread(self.release, deal_id, token):
+                logger.info(f"Deal {deal_id} changed during processing, processing again")
+                result = await (rerun or process)()
+            released = True
+            return result
+        finally:
+            if not released:
+                await asyncio.to_thread(self.release, deal_id, token, keep_for_rerun=False)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Надёжная локальная очередь событий сделок на SQLite (WAL)
+Вебхук только кладёт событие в очередь, обработку выполняет queue_worker.py
+События по одной сделке, пришедшие в окне тишины, объединяются в одну задачу
+Задачи разделены по порталам: обработчики могут не брать задачи порталов, которые уже заняты
+Неудачные задачи повторяются с экспоненциальной паузой со случайным разбросом; исчерпавшие
+попытки переносятся в таблицу dead_letters, откуда их можно вернуть в очередь (dead_letters.py)
+"""
+
+import os
+import time
+import random
+import logging
+
+from local_db import LocalDB
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deal_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    deal_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at REAL NOT NULL,
+    locked_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS queue_stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    portal TEXT NOT NULL,
+    deal_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    events INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dead_letters_portal ON dead_letters (portal, id);
+"""
+
+# Колонки, добавленные после первой версии очереди
+MIGRATIONS = {
+    'run_after': 'ALTER TABLE deal_events ADD COLUMN run_after REAL NOT NULL DEFAULT 0',
+    'events': 'ALTER TABLE deal_events ADD COLUMN events INTEGER NOT NULL DEFAULT 1',
+    'portal': "ALTER TABLE deal_events ADD COLUMN portal TEXT NOT NULL DEFAULT 'default'",
+}
+
+
+class DealQueue:
+    """Очередь событий сделок с арендой задач (lease) и объединением событий"""
+
+    def __init__(self, db_path=None, lease_seconds=None, coalesce_window=None, coalesce_max_delay=None,
+                 max_attempts=None, retry_base_delay=None, retry_max_delay=None):
+        self.db_path = db_path or os.getenv('QUEUE_DB_PATH', 'deal_queue.db')
+        self.lease_seconds = lease_seconds or int(os.getenv('QUEUE_LEASE_SECONDS', '120'))
+        self.coalesce_window = (coalesce_window if coalesce_window is not None
+                                else float(os.getenv('COALESCE_WINDOW', '2')))
+        # Непрерывный поток событий не должен откладывать обработку бесконечно
+        self.coalesce_max_delay = coalesce_max_delay or float(os.getenv('COALESCE_MAX_DELAY', '10'))
+        self.max_attempts = max_attempts or int(os.getenv('QUEUE_MAX_ATTEMPTS', '6'))
+        self.retry_base_delay = retry_base_delay or float(os.getenv('QUEUE_RETRY_BASE_DELAY', '30'))
+        self.retry_max_delay = retry_max_delay or float(os.getenv('QUEUE_RETRY_MAX_DELAY', '3600'))
+        self.db = LocalDB(self.db_path, SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Добавление недостающих колонок в очередь старой версии"""
+        conn = self.db.conn()
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(deal_events)')}
+        for column, statement in MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(statement)
+        conn.execute('DROP INDEX IF EXISTS idx_deal_events_status')
+        conn.execute('DROP INDEX IF EXISTS idx_deal_events_deal')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_deal_events_ready ON deal_events (status, run_after)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_deal_events_portal_deal ON deal_events (portal, deal_id, status)')
+
+    @staticmethod
+    def _count(conn, name):
+        """Увеличение счётчика статистики"""
+        conn.execute(
+            'INSERT INTO queue_stats (name, value) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+            (name,)
+        )
+
+    def put(self, deal_id, event, portal='default'):
+        """
+        Добавление события портала в очередь, возвращает ID задачи
+        Если по сделке уже есть ожидающая задача, событие присоединяется к ней,
+        а запуск переносится на конец окна тишины
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
+            self._count(conn, 'events_received')
+            row = conn.execute(
+                "SELECT id, created_at FROM deal_events WHERE portal = ? AND deal_id = ? AND status = 'pending'",
+                (portal, int(deal_id))
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE deal_events SET run_after = ?, events = events + 1, "
+                    "event = CASE WHEN event = 'ONCRMDEALADD' THEN event ELSE ? END WHERE id = ?",
+                    (min(now + self.coalesce_window, row[1] + self.coalesce_max_delay), event, row[0])
+                )
+                return row[0]
+            cursor = conn.execute(
+                'INSERT INTO deal_events (portal, deal_id, event, created_at, run_after) VALUES (?, ?, ?, ?, ?)',
+                (portal, int(deal_id), event, now, now + self.coalesce_window)
+            )
+            return cursor.lastrowid
+
+    def claim(self, exclude_portals=()):
+        """
+        Захват следующей задачи, у которой закончилось окно тишины; новые сделки (ONCRMDEALADD) - первыми
+        Задачи с истёкшей арендой (упавший воркер) выдаются повторно;
+        задачи порталов из exclude_portals пропускаются
+        """
+        now = time.time()
+        exclude_portals = list(exclude_portals)
+        portal_filter = f"AND portal NOT IN ({', '.join('?' * len(exclude_portals))}) " if exclude_portals else ''
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT id, deal_id, event, attempts, events, created_at, portal FROM deal_events "
+                "WHERE ((status = 'pending' AND run_after <= ?) "
+                "OR (status = 'processing' AND locked_until < ?)) " + portal_filter +
+                "ORDER BY event != 'ONCRMDEALADD', run_after LIMIT 1",
+                [now, now] + exclude_portals
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE deal_events SET status = 'processing', locked_until = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (now + self.lease_seconds, row[0])
+                )
+
+        if not row:
+            return None
+        return {
+            'id': row[0], 'deal_id': row[1], 'event': row[2],
+            'attempts': row[3] + 1, 'events': row[4], 'created_at': row[5], 'portal': row[6]
+        }
+
+    def retry_delay(self, attempts):
+        """Пауза перед следующей попыткой: удваивается с каждой попыткой, разброс 50-100%"""
+        delay = min(self.retry_base_delay * 2 ** (attempts - 1), self.retry_max_delay)
+        return delay * random.uniform(0.5, 1)
+
+    def schedule_retry(self, deal_id, event, portal='default'):
+        """
+        Повтор сделки, которую не удалось обработать вне очереди (первая попытка уже сделана)
+        Если по сделке уже есть ожидающая задача, новая не создаётся; возвращает ID задачи
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM deal_events WHERE portal = ? AND deal_id = ? AND status = 'pending'",
+                (portal, int(deal_id))
+            ).fetchone()
+            if row:
+                return row[0]
+            self._count(conn, 'retries_scheduled')
+            cursor = conn.execute(
+                'INSERT INTO deal_events (portal, deal_id, event, created_at, run_after, attempts) '
+                'VALUES (?, ?, ?, ?, ?, 1)',
+                (portal, int(deal_id), event, now, now + self.retry_delay(1))
+            )
+            return cursor.lastrowid
+
+    def fail(self, job):
+        """
+        Учёт неудачной попытки: задача возвращается в очередь с паузой,
+        а после max_attempts попыток переносится в dead_letters. Возвращает паузу или None
+        """
+        if job['attempts'] >= self.max_attempts:
+            self.dead_letter(job['id'])
+            return None
+        delay = self.retry_delay(job['attempts'])
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE deal_events SET status = 'pending', locked_until = NULL, run_after = ? WHERE id = ?",
+                (time.time() + delay, job['id'])
+            )
+            self._count(conn, 'retries_scheduled')
+        return delay
+
+    def dead_letter(self, job_id):
+        """Перенос задачи в dead_letters"""
+        with self.db.transaction() as conn:
+            conn.execute(
+                'INSERT INTO dead_letters (portal, deal_id, event, attempts, events, created_at, failed_at) '
+                'SELECT portal, deal_id, event, attempts, events, created_at, ? FROM deal_events WHERE id = ?',
+                (time.time(), job_id)
+            )
+            conn.execute('DELETE FROM deal_events WHERE id = ?', (job_id,))
+            self._count(conn, 'dead_lettered')
+
+    def dead_letters(self, portal=None, limit=100, after_id=0):
+        """Задачи из dead_letters по возрастанию ID"""
+        query = 'SELECT id, portal, deal_id, event, attempts, events, created_at, failed_at FROM dead_letters WHERE id > ?'
+        params = [after_id]
+        if portal:
+            query += ' AND portal = ?'
+            params.append(portal)
+        rows = self.db.conn().execute(query + ' ORDER BY id LIMIT ?', params + [limit]).fetchall()
+        keys = ('id', 'portal', 'deal_id', 'event', 'attempts', 'events', 'created_at', 'failed_at')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def replay(self, dead_letter_ids):
+        """
+        Возврат задач из dead_letters в очередь с обнулёнными попытками
+        Если по сделке уже есть ожидающая задача, к ней присоединяется событие; возвращает число задач
+        """
+        now = time.time()
+        replayed = 0
+        with self.db.transaction() as conn:
+            for dead_letter_id in dead_letter_ids:
+                row = conn.execute(
+                    'SELECT portal, deal_id, event, events FROM dead_letters WHERE id = ?', (dead_letter_id,)
+                ).fetchone()
+                if not row:
+                    continue
+                portal, deal_id, event, events = row
+                pending = conn.execute(
+                    "SELECT id FROM deal_events WHERE portal = ? AND deal_id = ? AND status = 'pending'",
+                    (portal, deal_id)
+                ).fetchone()
+                if pending:
+                    conn.execute('UPDATE deal_events SET events = events + ? WHERE id = ?', (events, pending[0]))
+                else:
+                    conn.execute(
+                        'INSERT INTO deal_events (portal, deal_id, event, created_at, run_after, events) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (portal, deal_id, event, now, now, events)
+                    )
+                conn.execute('DELETE FROM dead_letters WHERE id = ?', (dead_letter_id,))
+                self._count(conn, 'replayed')
+                replayed += 1
+        return replayed
+
+    def purge_dead_letters(self, before, portal=None):
+        """Удаление задач из dead_letters, перенесённых раньше момента before; возвращает число удалённых"""
+        query = 'DELETE FROM dead_letters WHERE failed_at < ?'
+        params = [before]
+        if portal:
+            query += ' AND portal = ?'
+            params.append(portal)
+        return self.db.conn().execute(query, params).rowcount
+
+    def ack(self, job_id):
+        """Удаление обработанной задачи"""
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM deal_events WHERE id = ?', (job_id,))
+            self._count(conn, 'runs_executed')
+
+    def depth(self):
+        """Количество задач в очереди"""
+        return self.db.conn().execute('SELECT COUNT(*) FROM deal_events').fetchone()[0]
+
+    def stats(self):
+        """
+        Глубина и возраст очереди, задачи в ожидании повтора и в dead_letters (всего и по порталам),
+        счётчики: получено событий / выполнено обработок / повторов / перенесено в dead_letters
+        """
+        conn = self.db.conn()
+        now = time.time()
+        counters = dict(conn.execute('SELECT name, value FROM queue_stats').fetchall())
+        portals = {
+            portal: {'depth': depth, 'oldest_age': round(now - oldest, 3), 'retrying': retrying, 'dead_letters': 0}
+            for portal, depth, oldest, retrying in conn.execute(
+                "SELECT portal, COUNT(*), MIN(created_at), SUM(status = 'pending' AND attempts > 0) "
+                "FROM deal_events GROUP BY portal"
+            )
+        }
+        for portal, count in conn.execute('SELECT portal, COUNT(*) FROM dead_letters GROUP BY portal'):
+            portals.setdefault(portal, {'depth': 0, 'oldest_age': 0, 'retrying': 0})['dead_letters'] = count
+        return {
+            'depth': sum(stats['depth'] for stats in portals.values()),
+            'oldest_age': max((stats['oldest_age'] for stats in portals.values()), default=0),
+            'retrying': sum(stats['retrying'] for stats in portals.values()),
+            'dead_letters': sum(stats['dead_letters'] for stats in portals.values()),
+            'events_received': counters.get('events_received', 0),
+            'runs_executed': counters.get('runs_executed', 0),
+            'retries_scheduled': counters.get('retries_scheduled', 0),
+            'dead_lettered': counters.get('dead_lettered', 0),
+            'portals': portals
+        }
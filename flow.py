@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общий ход операций для синхронного и асинхронного вариантов сервиса
+Операция пишется один раз как генератор: каждый ввод-вывод (запрос к API, ожидание лимита, пауза)
+он отдаёт через yield вызываемым объектом без аргументов и получает обратно его результат
+или исключение. run_flow() просто вызывает его; run_flow_async() ожидает возвращённую корутину,
+а участки генератора между yield (запросы к SQLite) выполняет в потоке, чтобы ожидание блокировки
+базы не останавливало цикл событий
+"""
+
+import asyncio
+
+
+def _advance(flow, value=None, error=None):
+    """Выполнение генератора до следующего yield: (True, вызов) или (False, результат операции)"""
+    try:
+        if error is not None:
+            return True, flow.throw(error)
+        return True, flow.send(value)
+    except StopIteration as stop:
+        return False, stop.value
+
+
+def run_flow(flow):
+    """Выполнение операции в текущем потоке"""
+    pending, step = _advance(flow)
+    while pending:
+        try:
+            value = step()
+        except Exception as e:
+            pending, step = _advance(flow, error=e)
+        else:
+            pending, step = _advance(flow, value)
+    return step
+
+
+async def run_flow_async(flow):
+    """Выполнение операции в цикле событий: вызовы возвращают awaitable, участки генератора идут в потоке"""
+    pending, step = await asyncio.to_thread(_advance, flow)
+    while pending:
+        try:
+            value = await step()
+        except Exception as e:
+            pending, step = await asyncio.to_thread(_advance, flow, None, e)
+        else:
+            pending, step = await asyncio.to_thread(_advance, flow, value)
+    return step
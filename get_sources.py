@@ -5,28 +5,25 @@
 """
 
 import json
-import requests
 from datetime import datetime
 
+from bitrix_client import BitrixAPI
+
 # Вебхук клиента
 WEBHOOK_URL = "https://promarketing1.bitrix24.ru/rest/9/fxn8xyfbalblll9s"
 
+api = BitrixAPI(WEBHOOK_URL, user_agent='BitrixSourcesScript/1.0')
+
 def get_deal_sources():
     """Получить список источников для сделок"""
     print("=== Получение источников сделок ===")
     
     try:
-        url = "{}/crm.status.list".format(WEBHOOK_URL)
-        params = {
+        data = api._make_request('crm.status.list', {
             'filter': {
                 'ENTITY_ID': 'SOURCE'
             }
-        }
-        
-        response = requests.post(url, json=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        })
         
         if 'result' in data:
             sources = data['result']
@@ -48,9 +45,6 @@ def get_deal_sources():
             print("Ошибка в ответе API: {}".format(data))
             return []
             
-    except requests.exceptions.RequestException as e:
-        print("Ошибка запроса: {}".format(e))
-        return []
     except Exception as e:
         print("Неожиданная ошибка: {}".format(e))
         return []
@@ -60,17 +54,11 @@ def get_contact_sources():
     print("\n=== Получение источников контактов ===")
     
     try:
-        url = "{}/crm.status.list".format(WEBHOOK_URL)
-        params = {
+        data = api._make_request('crm.status.list', {
             'filter': {
                 'ENTITY_ID': 'SOURCE_CONTACT'
             }
-        }
-        
-        response = requests.post(url, json=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        })
         
         if 'result' in data:
             sources = data['result']
@@ -92,9 +80,6 @@ def get_contact_sources():
             print("Ошибка в ответе API: {}".format(data))
             return []
             
-    except requests.exceptions.RequestException as e:
-        print("Ошибка запроса: {}".format(e))
-        return []
     except Exception as e:
         print("Неожиданная ошибка: {}".format(e))
         return []
@@ -104,17 +89,11 @@ def get_lead_sources():
     print("\n=== Получение источников лидов ===")
     
     try:
-        url = "{}/crm.status.list".format(WEBHOOK_URL)
-        params = {
+        data = api._make_request('crm.status.list', {
             'filter': {
                 'ENTITY_ID': 'SOURCE_LEAD'
             }
-        }
-        
-        response = requests.post(url, json=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        })
         
         if 'result' in data:
             sources = data['result']
@@ -136,9 +115,6 @@ def get_lead_sources():
             print("Ошибка в ответе API: {}".format(data))
             return []
             
-    except requests.exceptions.RequestException as e:
-        print("Ошибка запроса: {}".format(e))
-        return []
     except Exception as e:
         print("Неожиданная ошибка: {}".format(e))
         return []
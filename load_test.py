@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест сервиса вебхуков на локальной заглушке Битрикс24 (mock_bitrix.py)
+Отправляет события сделок в сервис и выводит p50/p95/p99 задержки, событий в секунду
+и число обращений к Битрикс24 на сделку. Пороговые значения (--max-p95-ms и др.)
+превращают тест в проверку регрессий производительности: при нарушении код выхода 1
+
+Полностью локальный запуск (заглушка и сервис поднимаются автоматически):
+    python3 load_test.py --spawn flask --deals 300 --updates 2 --latency-ms 50
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, pct):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def load_events(path):
+    """События из файла JSONL: одна полезная нагрузка вебхука на строку"""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def generate_events(deals, updates, seed=1):
+    """ONCRMDEALADD на каждую сделку и updates событий ONCRMDEALUPDATE вперемешку"""
+    rng = random.Random(seed)
+    events = [{'event': 'ONCRMDEALADD', 'data': {'FIELDS': {'ID': str(i)}}} for i in range(1, deals + 1)]
+    for _ in range(deals * updates):
+        deal_id = rng.randint(1, deals)
+        events.insert(rng.randint(0, len(events)),
+                      {'event': 'ONCRMDEALUPDATE', 'data': {'FIELDS': {'ID': str(deal_id)}}})
+    return events
+
+
+def wait_ready(url, timeout=30):
+    """Ожидание ответа 200 от url"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def spawn_services(args, workdir):
+    """Запуск заглушки Битрикс24, сервиса и (в режиме очереди) обработчика очереди"""
+    env = dict(os.environ,
+               BITRIX_WEBHOOK_URL=f"{args.mock}/rest",
+               WEBHOOK_MODE=args.mode,
+               LOG_FILE=os.path.join(workdir, 'webhook.log'),
+               BITRIX_RATE_LIMIT=str(args.client_rate),
+               BITRIX_RATE_BURST=str(args.client_burst))
+    port = args.target.split(':')[-1].split('/')[0]
+    mock_port = args.mock.rsplit(':', 1)[-1]
+    commands = [[
+        sys.executable, os.path.join(ROOT, 'mock_bitrix.py'), '--port', mock_port,
+        '--deals', str(args.deals), '--contacts', str(args.contacts),
+        '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+        '--rate', str(args.rate), '--burst', str(args.burst), '--error-rate', str(args.error_rate)
+    ]]
+    if args.spawn == 'asgi':
+        commands.append(['uvicorn', '--app-dir', ROOT, '--port', port, '--log-level', 'warning', 'asgi_app:app'])
+    else:
+        commands.append(['gunicorn', '--pythonpath', ROOT, '--bind', f"127.0.0.1:{port}",
+                         '--workers', str(args.workers), '--timeout', '30', 'app:app'])
+    if args.mode == 'queue':
+        commands.append([sys.executable, os.path.join(ROOT, 'queue_worker.py')])
+
+    # Файлы состояния (очередь, лимитер, кэш) создаются во временном каталоге
+    processes = [subprocess.Popen(cmd, cwd=workdir, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for cmd in commands]
+    if not wait_ready(f"{args.mock}/_mock/stats") or not wait_ready(health_url(args.target)):
+        stop_services(processes)
+        raise RuntimeError('Services did not start')
+    return processes
+
+
+def stop_services(processes):
+    """Остановка запущенных процессов"""
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait(timeout=30)
+
+
+def health_url(target):
+    """URL /health сервиса по URL вебхука"""
+    return target.split('/', 3)[0] + '//' + target.split('/', 3)[2] + '/health'
+
+
+def send_events(target, events, concurrency):
+    """Отправка событий; возвращает список задержек (сек) и число ошибок"""
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def send(event):
+        started = time.perf_counter()
+        try:
+            response = session.post(target, json=event, timeout=60)
+            ok = response.status_code in (200, 202)
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, events))
+    return sorted(latency for latency, _ in results), sum(1 for _, ok in results if not ok)
+
+
+def wait_queue_drained(target, timeout):
+    """Ожидание обработки очереди (режим queue); задачи, ожидающие повтора после ошибки, не учитываются"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        queue = requests.get(health_url(target), timeout=5).json().get('queue')
+        if not queue or queue.get('depth', 0) - queue.get('retrying', 0) <= 0:
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def run(args):
+    """Прогон теста; возвращает сводку"""
+    events = load_events(args.events) if args.events else generate_events(args.deals, args.updates)
+    deal_ids = {str(e.get('data', {}).get('FIELDS', {}).get('ID')) for e in events}
+    requests.post(f"{args.mock}/_mock/reset", timeout=5)
+
+    started = time.perf_counter()
+    latencies, errors = send_events(args.target, events, args.concurrency)
+    drained = wait_queue_drained(args.target, args.drain_timeout)
+    elapsed = time.perf_counter() - started
+
+    stats = requests.get(f"{args.mock}/_mock/stats", timeout=5).json()
+    return {
+        'events': len(events),
+        'deals': len(deal_ids),
+        'errors': errors,
+        'queue_drained': drained,
+        'elapsed_s': round(elapsed, 2),
+        'events_per_s': round(len(events) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'bitrix_http_requests': stats['http_requests'],
+        'bitrix_calls_per_deal': round(stats['http_requests'] / len(deal_ids), 2) if deal_ids else 0.0,
+        'bitrix_methods': stats['methods'],
+        'bitrix_throttled': stats['throttled'],
+        'deals_with_history': stats['deals_with_history']
+    }
+
+
+def check_gates(summary, args):
+    """Проверка порогов; возвращает список нарушений"""
+    failures = []
+    if args.max_p95_ms is not None and summary['p95_ms'] > args.max_p95_ms:
+        failures.append(f"p95 {summary['p95_ms']}ms > {args.max_p95_ms}ms")
+    if args.min_eps is not None and summary['events_per_s'] < args.min_eps:
+        failures.append(f"throughput {summary['events_per_s']}/s < {args.min_eps}/s")
+    if args.max_calls_per_deal is not None and summary['bitrix_calls_per_deal'] > args.max_calls_per_deal:
+        failures.append(f"calls per deal {summary['bitrix_calls_per_deal']} > {args.max_calls_per_deal}")
+    if args.max_errors is not None and summary['errors'] > args.max_errors:
+        failures.append(f"errors {summary['errors']} > {args.max_errors}")
+    if not summary['queue_drained']:
+        failures.append('queue was not drained')
+    return failures
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Нагрузочный тест сервиса вебхуков Битрикс24')
+    parser.add_argument('--target', default='http://127.0.0.1:5000/webhook/deal', help='URL вебхука сервиса')
+    parser.add_argument('--mock', default='http://127.0.0.1:5900', help='URL заглушки Битрикс24')
+    parser.add_argument('--spawn', choices=['none', 'flask', 'asgi'], default='none',
+                        help='запустить заглушку и сервис локально')
+    parser.add_argument('--mode', choices=['sync', 'queue'], default='sync', help='WEBHOOK_MODE сервиса')
+    parser.add_argument('--workers', type=int, default=2, help='воркеры gunicorn при --spawn flask')
+    parser.add_argument('--events', help='файл JSONL с событиями вебхука')
+    parser.add_argument('--deals', type=int, default=200, help='число сделок для синтетических событий')
+    parser.add_argument('--updates', type=int, default=1, help='ONCRMDEALUPDATE на сделку')
+    parser.add_argument('--contacts', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--drain-timeout', type=float, default=300)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--rate', type=float, default=0, help='лимит заглушки, запросов в секунду')
+    parser.add_argument('--burst', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--client-rate', type=float, default=1000, help='BITRIX_RATE_LIMIT сервиса')
+    parser.add_argument('--client-burst', type=float, default=1000, help='BITRIX_RATE_BURST сервиса')
+    parser.add_argument('--max-p95-ms', type=float)
+    parser.add_argument('--min-eps', type=float)
+    parser.add_argument('--max-calls-per-deal', type=float)
+    parser.add_argument('--max-errors', type=int)
+    args = parser.parse_args()
+
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if args.spawn != 'none':
+                processes = spawn_services(args, workdir)
+            summary = run(args)
+        finally:
+            stop_services(processes)
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    failures = check_gates(summary, args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальные файлы SQLite для общего состояния процессов (очередь, кэш, журналы)
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class LocalDB:
+    """Файл SQLite в режиме WAL с отдельным соединением для каждого потока"""
+
+    def __init__(self, path, schema=None):
+        self.path = path
+        self._local = threading.local()
+        if schema:
+            self.conn().executescript(schema)
+
+    def conn(self):
+        """Соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # В режиме WAL NORMAL переживает падение процесса и не делает fsync на каждый коммит
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция с немедленной блокировкой на запись"""
+        conn = self.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
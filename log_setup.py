@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Настройка логирования сервиса
+Записи уходят в очередь и пишутся в файл фоновым потоком (QueueHandler/QueueListener),
+поэтому запись на диск не задерживает обработку запроса. Файл - JSON-lines.
+В один файл пишут все воркеры gunicorn и служебные процессы, поэтому сами процессы файл не ротируют:
+ротацию выполняет logrotate (bitrix_webhook.logrotate), а WatchedFileHandler переоткрывает
+переименованный файл
+"""
+
+import os
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime
+
+# Доля запросов, для которых полезная нагрузка пишется в лог целиком (при LOG_LEVEL=DEBUG - все)
+PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+
+# Фоновый поток записи текущей настройки
+_listener = None
+
+
+def stop_logging():
+    """Запись оставшихся записей и закрытие файла"""
+    if _listener:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+
+
+atexit.register(stop_logging)
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON; поля из extra={'fields': {...}} добавляются в запись"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(default_file, file_env='LOG_FILE'):
+    """
+    Настройка корневого логгера: очередь в памяти и фоновая запись в файл и консоль
+    Путь к файлу берётся из переменной file_env, уровень - из LOG_LEVEL.
+    Повторный вызов (скрипт со своим файлом импортирует app) заменяет предыдущую настройку
+    """
+    global _listener
+    file_handler = logging.handlers.WatchedFileHandler(os.getenv(file_env, default_file), encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    stop_logging()
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+
+
+def payload_sampled(logger):
+    """Нужно ли записать полезную нагрузку запроса целиком"""
+    return logger.isEnabledFor(logging.DEBUG) or random.random() < PAYLOAD_SAMPLE_RATE
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Метрики Prometheus для /metrics
+Чтобы метрики суммировались по всем воркерам gunicorn и queue_worker.py, задайте
+PROMETHEUS_MULTIPROC_DIR - общий каталог, в который процессы пишут свои значения
+"""
+
+import os
+import time
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# prometheus_client не создаёт каталог и падает при первом изменении метрики - проверяем сразу при запуске
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR and not os.path.isdir(MULTIPROC_DIR):
+    raise RuntimeError(
+        f"PROMETHEUS_MULTIPROC_DIR={MULTIPROC_DIR} does not exist: create it before starting the service "
+        "or unset the variable"
+    )
+
+EVENTS = Counter(
+    'bitrix_webhook_events_total', 'Webhook events received', ['event', 'route', 'portal']
+)
+API_REQUEST_SECONDS = Histogram(
+    'bitrix_webhook_api_request_seconds', 'Bitrix24 REST call duration including rate limit waits and retries',
+    ['method', 'portal']
+)
+API_ERRORS = Counter(
+    'bitrix_webhook_api_errors_total', 'Bitrix24 REST errors', ['method', 'code', 'portal']
+)
+CONTACT_CACHE = Counter(
+    'bitrix_webhook_contact_cache_total', 'Contact reasons cache lookups', ['result', 'portal']
+)
+EVENT_TO_WRITE_SECONDS = Histogram(
+    'bitrix_webhook_event_to_write_seconds', 'Time from webhook receipt to the deal update', ['priority', 'portal'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    'bitrix_webhook_rate_limit_wait_seconds', 'Time a Bitrix24 request waited for the shared rate limit',
+    ['priority', 'portal'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+WRITE_BATCH_SIZE = Histogram(
+    'bitrix_webhook_write_batch_size', 'Deal updates sent in one request by the write batcher', ['portal'],
+    buckets=(1, 2, 5, 10, 20, 30, 40, 50)
+)
+DEAL_LOCKS = Counter(
+    'bitrix_webhook_deal_locks_total', 'Per-deal lock outcomes: acquired, busy (rerun requested), rerun',
+    ['result', 'portal']
+)
+CIRCUIT_TRANSITIONS = Counter(
+    'bitrix_webhook_circuit_transitions_total', 'Circuit breaker state changes', ['portal', 'state']
+)
+
+# Значения метрики состояния автомата отключения
+CIRCUIT_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+class QueueCollector:
+    """Глубина и возраст очереди, задачи в dead_letters по порталам; читаются из файла очереди при каждом запросе /metrics"""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def collect(self):
+        depth = GaugeMetricFamily('bitrix_webhook_queue_depth', 'Jobs in the deal queue', labels=['portal'])
+        oldest_age = GaugeMetricFamily(
+            'bitrix_webhook_queue_oldest_age_seconds', 'Age of the oldest queued event', labels=['portal']
+        )
+        retrying = GaugeMetricFamily(
+            'bitrix_webhook_queue_retrying', 'Failed jobs waiting for a retry', labels=['portal']
+        )
+        dead_letters = GaugeMetricFamily(
+            'bitrix_webhook_dead_letters', 'Jobs that exhausted their retries', labels=['portal']
+        )
+        for portal, stats in self.queue.stats()['portals'].items():
+            depth.add_metric([portal], stats['depth'])
+            oldest_age.add_metric([portal], stats['oldest_age'])
+            retrying.add_metric([portal], stats['retrying'])
+            dead_letters.add_metric([portal], stats['dead_letters'])
+        yield depth
+        yield oldest_age
+        yield retrying
+        yield dead_letters
+
+
+class CircuitCollector:
+    """Состояние автоматов отключения порталов; читается из их файлов при каждом запросе /metrics"""
+
+    def __init__(self, breakers):
+        self.breakers = breakers
+
+    def collect(self):
+        state = GaugeMetricFamily(
+            'bitrix_webhook_circuit_state', 'Circuit breaker state: 0 closed, 1 half-open, 2 open', labels=['portal']
+        )
+        for breaker in self.breakers:
+            state.add_metric([breaker.portal], CIRCUIT_STATE_VALUES[breaker.stats()['state']])
+        yield state
+
+
+def observe_api_call(method, started, data, portal):
+    """Учёт вызова REST API портала: длительность и код ошибки"""
+    API_REQUEST_SECONDS.labels(method, portal).observe(time.time() - started)
+    if isinstance(data, dict) and 'error' in data:
+        API_ERRORS.labels(method, data['error'], portal).inc()
+
+
+def render(queue=None, breakers=()):
+    """Текст метрик в формате Prometheus и его Content-Type"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    output = generate_latest(registry)
+
+    local_registry = CollectorRegistry()
+    if queue is not None:
+        local_registry.register(QueueCollector(queue))
+    if breakers:
+        local_registry.register(CircuitCollector(breakers))
+    output += generate_latest(local_registry)
+    return output, CONTENT_TYPE_LATEST
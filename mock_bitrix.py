@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальная замена REST API Битрикс24 для нагрузочных тестов (см. load_test.py)
+Реализует используемые сервисом методы на сгенерированных данных с настраиваемой
+задержкой, ограничением частоты запросов и внедрением ошибок
+
+Запуск: python3 mock_bitrix.py --port 5900 --latency-ms 150 --rate 2 --burst 50
+URL вебхука для сервиса: http://127.0.0.1:5900/rest
+"""
+
+import re
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, quote
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+
+CONTACT_REASONS_FIELD = 'UF_CRM_1755175983293'
+DEAL_HISTORY_FIELD = 'UF_CRM_1755175908229'
+PAGE_SIZE = 50
+RESULT_REF = re.compile(r'\$result\[(\w+)\]((?:\[\w+\])*)')
+
+
+class MockState:
+    """Данные портала, счётчики вызовов и настройки поведения"""
+
+    def __init__(self, deals=1000, contacts=200, latency_ms=0, jitter_ms=0, rate=0, burst=50, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate = rate
+        self.burst = burst
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.tokens_at = time.time()
+        self.generate(deals, contacts)
+        self.reset_stats()
+
+    def generate(self, deals, contacts):
+        """Генерация контактов с причинами отказов и новых сделок"""
+        now = datetime.now().astimezone()
+        self.contacts = {}
+        for contact_id in range(1, contacts + 1):
+            reasons = '\n'.join(f"Причина {contact_id}-{n}" for n in range(1, contact_id % 4 + 1))
+            self.contacts[contact_id] = {
+                'ID': str(contact_id),
+                'NAME': f"Контакт {contact_id}",
+                'DATE_MODIFY': (now - timedelta(days=1)).isoformat(timespec='seconds'),
+                CONTACT_REASONS_FIELD: reasons
+            }
+        self.deals = {}
+        for deal_id in range(1, deals + 1):
+            self.deals[deal_id] = {
+                'ID': str(deal_id),
+                'TITLE': f"Сделка {deal_id}",
+                'STAGE_ID': 'NEW',
+                'CONTACT_ID': str((deal_id - 1) % contacts + 1) if contacts else None,
+                'DATE_CREATE': (now - timedelta(seconds=deals - deal_id)).isoformat(timespec='seconds'),
+                DEAL_HISTORY_FIELD: []
+            }
+
+    def reset_stats(self):
+        """Сброс счётчиков вызовов"""
+        with self.lock:
+            self.http_requests = 0
+            self.throttled = 0
+            self.injected_errors = 0
+            self.methods = {}
+
+    def count(self, method):
+        """Учёт вызова метода (в том числе внутри batch)"""
+        with self.lock:
+            self.methods[method] = self.methods.get(method, 0) + 1
+
+    def take_token(self):
+        """Token bucket как у Битрикс24; rate=0 отключает ограничение"""
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.tokens_at) * self.rate)
+            self.tokens_at = now
+            if self.tokens < 1:
+                self.throttled += 1
+                return False
+            self.tokens -= 1
+            return True
+
+
+state = None
+
+
+def parse_query(query):
+    """Разбор строки команды batch с ключами вида fields[NAME][0] во вложенный словарь"""
+    params = {}
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        path = re.findall(r'[^\[\]]+', key)
+        node = params
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = value
+    return _lists(params)
+
+
+def _lists(node):
+    """Словари с ключами 0..n превращаются в списки"""
+    if not isinstance(node, dict):
+        return node
+    node = {key: _lists(value) for key, value in node.items()}
+    if node and all(key.isdigit() for key in node):
+        return [node[key] for key in sorted(node, key=int)]
+    return node
+
+
+class MethodError(Exception):
+    """Ошибка метода в формате Битрикс24"""
+
+    def __init__(self, code, description, status=400):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.status = status
+
+
+def _param(params, name):
+    """Параметр без учёта регистра ключа"""
+    return params.get(name, params.get(name.lower()))
+
+
+def _compare_value(field, value):
+    """Значение для сравнения: даты разбираются, числа приводятся"""
+    if value is None:
+        return None
+    if field.startswith('DATE_'):
+        return datetime.fromisoformat(str(value).replace(' ', 'T'))
+    if field == 'ID' or str(value).lstrip('-').isdigit():
+        return int(value)
+    return str(value)
+
+
+def _matches(entity, filters):
+    """Проверка записи по фильтру вида {'>ID': 10, 'STAGE_ID': 'NEW', 'UF_X': ''}"""
+    for key, expected in (filters or {}).items():
+        match = re.match(r'^(>=|<=|>|<|!|=)?(.+)$', key)
+        op, field = match.group(1) or '=', match.group(2)
+        actual = entity.get(field)
+        if expected is None or expected is False or expected == '' or expected == []:
+            empty = actual in (None, '', False) or actual == []
+            if empty != (op != '!'):
+                return False
+            continue
+        if actual is None:
+            return False
+        left, right = _compare_value(field, actual), _compare_value(field, expected)
+        if isinstance(left, datetime) and left.tzinfo and not right.tzinfo:
+            right = right.replace(tzinfo=left.tzinfo)
+        if ((op == '=' and left != right) or (op == '!' and left == right)
+                or (op == '>' and not left > right) or (op == '<' and not left < right)
+                or (op == '>=' and not left >= right) or (op == '<=' and not left <= right)):
+            return False
+    return True
+
+
+def _project(entity, select):
+    """Выбор полей по select (по умолчанию все)"""
+    if not select or '*' in select or 'UF_*' in select:
+        return dict(entity)
+    return {field: entity.get(field) for field in select}
+
+
+def list_entities(entities, params):
+    """Общая реализация crm.*.list с фильтром, сортировкой и постраничной выборкой"""
+    items = [e for e in entities.values() if _matches(e, _param(params, 'filter'))]
+    for field, direction in reversed(list((_param(params, 'order') or {'ID': 'ASC'}).items())):
+        items.sort(key=lambda e: _compare_value(field, e.get(field)) or 0, reverse=str(direction).upper() == 'DESC')
+
+    start = int(_param(params, 'start') or 0)
+    offset = max(start, 0)
+    page = [_project(e, _param(params, 'select')) for e in items[offset:offset + PAGE_SIZE]]
+    response = {'result': page}
+    # start=-1 отключает подсчёт total и навигацию, как в Битрикс24
+    if start >= 0:
+        response['total'] = len(items)
+        if offset + PAGE_SIZE < len(items):
+            response['next'] = offset + PAGE_SIZE
+    return response
+
+
+def _get_entity(entities, params, name):
+    """crm.*.get"""
+    entity_id = _param(params, 'ID')
+    if not entity_id or not str(entity_id).isdigit():
+        raise MethodError('ERROR_CORE', 'ID is not defined or invalid.')
+    entity = entities.get(int(entity_id))
+    if entity is None:
+        raise MethodError('NOT_FOUND', f"{name} is not found.")
+    return {'result': dict(entity)}
+
+
+def call_method(method, params):
+    """Выполнение метода REST API над данными заглушки"""
+    state.count(method)
+    if method == 'crm.deal.get':
+        return _get_entity(state.deals, params, 'Deal')
+    if method == 'crm.contact.get':
+        return _get_entity(state.contacts, params, 'Contact')
+    if method == 'crm.deal.list':
+        return list_entities(state.deals, params)
+    if method == 'crm.contact.list':
+        return list_entities(state.contacts, params)
+    if method == 'crm.deal.update':
+        deal = _get_entity(state.deals, params, 'Deal')['result']
+        with state.lock:
+            state.deals[int(deal['ID'])].update(_param(params, 'fields') or {})
+        return {'result': True}
+    if method == 'crm.status.list':
+        return {'result': [
+            {'ENTITY_ID': 'SOURCE', 'STATUS_ID': 'CALL', 'NAME': 'Сайт', 'SORT': 10},
+            {'ENTITY_ID': 'SOURCE', 'STATUS_ID': 'WEBFORM', 'NAME': 'Яндекс.Карты', 'SORT': 20}
+        ]}
+    if method == 'batch':
+        return call_batch(params)
+    raise MethodError('ERROR_METHOD_NOT_FOUND', 'Method not found!', status=404)
+
+
+def _resolve(query, results):
+    """
+    Подстановка ссылок $result[name][field] на результаты предыдущих команд
+    Как в Битрикс24, подстановка идёт по строке команды до её разбора: закодированный $ (%24) не подставляется
+    """
+    def substitute(match):
+        node = results.get(match.group(1))
+        for key in re.findall(r'\[(\w+)\]', match.group(2)):
+            node = node.get(key) if isinstance(node, dict) else None
+        return quote(str(node if node is not None else ''), safe='')
+    return RESULT_REF.sub(substitute, query)
+
+
+def call_batch(params):
+    """Метод batch: команды с подстановкой результатов, halt останавливает на первой ошибке"""
+    commands = _param(params, 'cmd') or {}
+    halt = str(_param(params, 'halt') or 0) == '1'
+    results, errors = {}, {}
+    for name, command in commands.items():
+        method, _, query = command.partition('?')
+        try:
+            results[name] = call_method(method, parse_query(_resolve(query, results)))['result']
+        except MethodError as e:
+            errors[name] = {'error': e.code, 'error_description': e.description}
+            if halt:
+                break
+    # Пустые результаты Битрикс24 отдаёт массивами
+    return {'result': {'result': results or [], 'result_error': errors or [], 'result_total': [], 'result_next': []}}
+
+
+@app.route('/rest/<path:method>', methods=['GET', 'POST'])
+def rest(method):
+    """Точка входа REST API: /rest/<method>.json"""
+    started = time.time()
+    method = method[:-5] if method.endswith('.json') else method
+    with state.lock:
+        state.http_requests += 1
+
+    if state.latency_ms or state.jitter_ms:
+        time.sleep((state.latency_ms + random.uniform(0, state.jitter_ms)) / 1000)
+    if not state.take_token():
+        return jsonify({'error': 'QUERY_LIMIT_EXCEEDED', 'error_description': 'Too many requests'}), 503
+    if state.error_rate and random.random() < state.error_rate:
+        with state.lock:
+            state.injected_errors += 1
+        return jsonify({'error': 'INTERNAL_SERVER_ERROR', 'error_description': 'Injected error'}), 500
+
+    params = request.get_json(silent=True) if request.is_json else parse_query(request.query_string.decode())
+    try:
+        response = call_method(method, params or {})
+    except MethodError as e:
+        return jsonify({'error': e.code, 'error_description': e.description}), e.status
+    finished = time.time()
+    response['time'] = {'start': started, 'finish': finished, 'duration': finished - started, 'operating': 0}
+    return jsonify(response)
+
+
+@app.route('/_mock/stats', methods=['GET'])
+def mock_stats():
+    """Счётчики вызовов"""
+    with state.lock:
+        return jsonify({
+            'http_requests': state.http_requests,
+            'throttled': state.throttled,
+            'injected_errors': state.injected_errors,
+            'methods': dict(state.methods),
+            'deals_with_history': sum(1 for d in state.deals.values() if d.get(DEAL_HISTORY_FIELD))
+        })
+
+
+@app.route('/_mock/reset', methods=['POST'])
+def mock_reset():
+    """Сброс счётчиков"""
+    state.reset_stats()
+    return jsonify({'status': 'ok'})
+
+
+def main():
+    """Основная функция"""
+    global state
+    parser = argparse.ArgumentParser(description='Локальная замена REST API Битрикс24')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5900)
+    parser.add_argument('--deals', type=int, default=1000, help='число сделок')
+    parser.add_argument('--contacts', type=int, default=200, help='число контактов')
+    parser.add_argument('--latency-ms', type=float, default=0, help='задержка ответа')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='случайная добавка к задержке')
+    parser.add_argument('--rate', type=float, default=0, help='лимит запросов в секунду (0 - без лимита)')
+    parser.add_argument('--burst', type=float, default=50, help='размер пачки token bucket')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов с ошибкой 500')
+    args = parser.parse_args()
+
+    state = MockState(args.deals, args.contacts, args.latency_ms, args.jitter_ms,
+                      args.rate, args.burst, args.error_rate)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Журнал собственных записей в сделки
+Каждый crm.deal.update порождает ONCRMDEALUPDATE; по журналу такое эхо-событие
+отбрасывается до обращения к API
+"""
+
+import os
+import time
+
+from local_db import LocalDB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS own_writes (
+    deal_id INTEGER PRIMARY KEY,
+    written_at REAL NOT NULL
+);
+"""
+
+
+class OwnWritesLog:
+    """Недавние записи в сделки, общие для всех процессов"""
+
+    def __init__(self, db_path=None, ttl=None):
+        self.db_path = db_path or os.getenv('OWN_WRITES_DB_PATH', 'own_writes.db')
+        self.ttl = ttl or int(os.getenv('OWN_WRITES_TTL', '30'))
+        self.db = LocalDB(self.db_path, SCHEMA)
+
+    def record(self, deal_id):
+        """Отметка о записи в сделку"""
+        now = time.time()
+        conn = self.db.conn()
+        conn.execute(
+            'INSERT OR REPLACE INTO own_writes (deal_id, written_at) VALUES (?, ?)',
+            (int(deal_id), now)
+        )
+        conn.execute('DELETE FROM own_writes WHERE written_at < ?', (now - self.ttl,))
+
+    def forget(self, deal_id):
+        """Удаление отметки (запись не состоялась)"""
+        self.db.conn().execute('DELETE FROM own_writes WHERE deal_id = ?', (int(deal_id),))
+
+    def consume(self, deal_id):
+        """
+        Проверка, что событие по сделке - эхо нашей записи
+        Отметка удаляется, поэтому отбрасывается только первое такое событие
+        """
+        cursor = self.db.conn().execute(
+            'DELETE FROM own_writes WHERE deal_id = ? AND written_at >= ?',
+            (int(deal_id), time.time() - self.ttl)
+        )
+        return cursor.rowcount > 0
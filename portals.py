@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Порталы Битрикс24, которые обслуживает сервис
+Список задаётся файлом JSON (PORTALS_CONFIG): для каждого портала - имя, домен, входящий вебхук REST,
+токен приложения исходящего вебхука и при необходимости свои лимиты запросов.
+У каждого портала свой каталог состояния (лимитер, автомат отключения, локальная копия контактов,
+индексы), поэтому порталы не делят ни лимит запросов, ни данные, а недоступность одного не влияет
+на другие. Без файла сервис работает с одним порталом из BITRIX_WEBHOOK_URL и BITRIX_APPLICATION_TOKEN
+с прежними путями файлов состояния
+"""
+
+import os
+import json
+import logging
+
+from rate_limiter import RateLimiter
+from circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Имя портала в режиме одного портала (метки метрик, очередь)
+DEFAULT_PORTAL = 'default'
+
+
+class Portal:
+    """Настройки одного портала"""
+
+    def __init__(self, name, webhook_url, domain=None, application_token=None, data_dir=None,
+                 rate_limit=None, rate_burst=None):
+        self.name = name
+        self.webhook_url = webhook_url
+        self.domain = domain.lower() if domain else None
+        self.application_token = application_token or None
+        self.data_dir = data_dir
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+
+    def db_path(self, filename):
+        """Путь к файлу состояния портала; None - путь по умолчанию из переменных окружения"""
+        return os.path.join(self.data_dir, filename) if self.data_dir else None
+
+    def rate_limiter(self):
+        """Ограничитель запросов портала"""
+        return RateLimiter(
+            db_path=self.db_path('rate_limiter.db'), rate=self.rate_limit, burst=self.rate_burst, portal=self.name
+        )
+
+    def circuit_breaker(self):
+        """Автомат отключения портала"""
+        return CircuitBreaker(db_path=self.db_path('circuit_breaker.db'), portal=self.name)
+
+
+class PortalRegistry:
+    """Порталы по имени и определение портала события по токену приложения или домену"""
+
+    def __init__(self, portals):
+        self.portals = {portal.name: portal for portal in portals}
+        self.by_token = {portal.application_token: portal for portal in portals if portal.application_token}
+        self.by_domain = {portal.domain: portal for portal in portals if portal.domain}
+
+    def __iter__(self):
+        return iter(self.portals.values())
+
+    def __len__(self):
+        return len(self.portals)
+
+    def get(self, name):
+        """Портал по имени или None"""
+        return self.portals.get(name)
+
+    def resolve(self, token, domain):
+        """
+        Портал события: по токену приложения, а для портала без токена - по auth[domain]
+        Единственный портал без домена принимает все события (режим одного портала).
+        Возвращает None, если портал неизвестен или токен не подходит
+        """
+        if token and token in self.by_token:
+            return self.by_token[token]
+
+        portal = self.by_domain.get(domain.lower()) if domain else None
+        if portal is None and len(self.portals) == 1:
+            only = next(iter(self.portals.values()))
+            portal = only if not only.domain else None
+        if portal is None or portal.application_token:
+            return None
+        return portal
+
+
+def load_portals(path=None):
+    """Реестр порталов из PORTALS_CONFIG или из BITRIX_WEBHOOK_URL, если файл не задан"""
+    path = path or os.getenv('PORTALS_CONFIG')
+    if not path:
+        webhook_url = os.getenv('BITRIX_WEBHOOK_URL')
+        if not webhook_url:
+            return PortalRegistry([])
+        return PortalRegistry([
+            Portal(DEFAULT_PORTAL, webhook_url, application_token=os.getenv('BITRIX_APPLICATION_TOKEN'))
+        ])
+
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+
+    data_root = os.getenv('PORTALS_DATA_DIR', 'portals')
+    portals = []
+    for entry in entries:
+        name = entry.get('name') or entry['domain']
+        portals.append(Portal(
+            name,
+            entry['webhook_url'],
+            domain=entry.get('domain'),
+            application_token=entry.get('application_token'),
+            data_dir=entry.get('data_dir') or os.path.join(data_root, name),
+            rate_limit=entry.get('rate_limit'),
+            rate_burst=entry.get('rate_burst')
+        ))
+        if not entry.get('application_token'):
+            logger.warning(f"Portal {name} has no application token, events are matched by domain only")
+    return PortalRegistry(portals)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Классы приоритета запросов к API Битрикс24
+add - обработка новых сделок (ONCRMDEALADD), update - изменения сделок, background - сверка, CRON,
+заполнение существующих сделок и синхронизация контактов. Класс текущей обработки хранится
+в contextvars (свой у каждого потока и задачи asyncio) и учитывается общим ограничителем запросов:
+пока ждут запросы старшего класса, младшие не расходуют лимит. Фоновые скрипты задают класс
+по умолчанию для всего процесса через set_default_priority()
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+PRIORITY_ADD = 'add'
+PRIORITY_UPDATE = 'update'
+PRIORITY_BACKGROUND = 'background'
+
+# От старшего к младшему
+PRIORITIES = (PRIORITY_ADD, PRIORITY_UPDATE, PRIORITY_BACKGROUND)
+
+_current = ContextVar('bitrix_priority', default=None)
+_default = PRIORITY_UPDATE
+
+
+def set_default_priority(name):
+    """Класс приоритета процесса - для потоков и задач, где он не задан явно"""
+    global _default
+    _default = name
+
+
+def current_priority():
+    """Класс приоритета текущей обработки"""
+    return _current.get() or _default
+
+
+def higher_priorities(name):
+    """Классы старше name"""
+    return PRIORITIES[:PRIORITIES.index(name)]
+
+
+def event_priority(event):
+    """Класс приоритета события вебхука"""
+    return PRIORITY_ADD if event == 'ONCRMDEALADD' else PRIORITY_UPDATE
+
+
+@contextmanager
+def use_priority(name):
+    """Выполнение блока с классом приоритета name"""
+    token = _current.set(name)
+    try:
+        yield
+    finally:
+        _current.reset(token)
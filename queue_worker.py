@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пул обработчиков очереди событий сделок
+Забирает события из deal_queue.py и обрабатывает их через DealProcessor своего портала;
+один портал занимает не больше QUEUE_PORTAL_CONCURRENCY обработчиков, поэтому медленный
+или упёршийся в лимит запросов портал не задерживает остальные. Задачи портала с открытым
+автоматом отключения (circuit_breaker.py) остаются в очереди, пока портал не станет доступен.
+Неудачная задача возвращается в очередь с растущей паузой, после QUEUE_MAX_ATTEMPTS попыток -
+в dead_letters (см. dead_letters.py)
+По SIGTERM перестаёт брать новые задачи и дожидается завершения текущих
+"""
+
+import os
+import signal
+import logging
+import threading
+from collections import Counter
+
+from app import deal_processors
+from deal_queue import DealQueue
+from priority import event_priority, use_priority
+
+logger = logging.getLogger('queue_worker')
+
+
+class QueueWorkerPool:
+    """Пул потоков, разбирающих очередь"""
+
+    def __init__(self, queue, processors, workers=None, poll_interval=None, portal_concurrency=None):
+        self.queue = queue
+        self.processors = processors
+        self.workers = workers or int(os.getenv('QUEUE_WORKERS', '4'))
+        self.poll_interval = poll_interval or float(os.getenv('QUEUE_POLL_INTERVAL', '0.5'))
+        # Один портал может занять все обработчики, только если он единственный
+        if len(processors) <= 1:
+            self.portal_concurrency = self.workers
+        else:
+            self.portal_concurrency = portal_concurrency or int(
+                os.getenv('QUEUE_PORTAL_CONCURRENCY', str(max(1, self.workers // 2)))
+            )
+        self.in_flight = Counter()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def _claim(self):
+        """Захват задачи доступного портала, у которого есть свободные обработчики"""
+        unavailable = [name for name, processor in self.processors.items() if processor.api.circuit_breaker.is_open()]
+        with self.lock:
+            busy = [portal for portal, count in self.in_flight.items() if count >= self.portal_concurrency]
+            job = self.queue.claim(exclude_portals=busy + unavailable)
+            if job:
+                self.in_flight[job['portal']] += 1
+            return job
+
+    def _release(self, job):
+        """Освобождение обработчика портала"""
+        with self.lock:
+            self.in_flight[job['portal']] -= 1
+
+    def _rejection_reason(self, job):
+        """Почему задачу нельзя выполнять: портал удалён из настроек или задача уже роняла обработчики"""
+        if job['portal'] not in self.processors:
+            return 'portal is not configured'
+        if job['attempts'] > self.queue.max_attempts:
+            return 'too many attempts'
+        return None
+
+    def _process(self, job):
+        """Обработка задачи процессором её портала, возвращает True при успехе"""
+        processor = self.processors[job['portal']]
+        logger.info(f"Processing queued {job['event']} for deal {job['deal_id']} of portal {job['portal']} "
+                    f"({job['events']} events, attempt {job['attempts']})")
+        try:
+            with use_priority(event_priority(job['event'])):
+                return processor.process_new_deal(job['deal_id'], received_at=job['created_at'])
+        except Exception as e:
+            logger.error(f"Error processing queued deal {job['deal_id']}: {e}")
+            return False
+
+    def _complete(self, job, success):
+        """Удаление выполненной задачи или планирование повтора"""
+        if success:
+            self.queue.ack(job['id'])
+            return
+        delay = self.queue.fail(job)
+        if delay is None:
+            logger.error(f"Deal {job['deal_id']} of portal {job['portal']} moved to dead letters "
+                         f"after {job['attempts']} attempts")
+        else:
+            logger.warning(f"Failed to process queued deal {job['deal_id']}, retry in {delay:.0f}s "
+                           f"(attempt {job['attempts']} of {self.queue.max_attempts})")
+
+    def _run(self):
+        """Цикл одного обработчика"""
+        while not self.stop_event.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"Failed to claim job: {e}")
+                self.stop_event.wait(self.poll_interval)
+                continue
+
+            if not job:
+                self.stop_event.wait(self.poll_interval)
+                continue
+
+            reason = self._rejection_reason(job)
+            if reason:
+                logger.error(f"Deal {job['deal_id']} of portal {job['portal']} moved to dead letters: {reason}")
+                self.queue.dead_letter(job['id'])
+                self._release(job)
+                continue
+
+            try:
+                success = self._process(job)
+            finally:
+                self._release(job)
+            self._complete(job, success)
+
+    def start(self):
+        """Запуск потоков"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"queue-worker-{i}")
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Queue worker pool started with {self.workers} workers, "
+                    f"up to {self.portal_concurrency} per portal")
+
+    def stop(self, *_):
+        """Плавная остановка: текущие задачи дорабатываются"""
+        logger.info("Stopping queue worker pool, draining in-flight jobs...")
+        self.stop_event.set()
+
+    def join(self):
+        """Ожидание завершения потоков"""
+        for thread in self.threads:
+            thread.join()
+        logger.info(f"Queue worker pool stopped, {self.queue.depth()} jobs left in queue")
+
+
+def main():
+    """Основная функция"""
+    if not deal_processors:
+        logger.error("BITRIX_WEBHOOK_URL or PORTALS_CONFIG not configured")
+        return
+
+    pool = QueueWorkerPool(DealQueue(), deal_processors)
+    signal.signal(signal.SIGTERM, pool.stop)
+    signal.signal(signal.SIGINT, pool.stop)
+    pool.start()
+    pool.join()
+
+
+if __name__ == '__main__':
+    main()
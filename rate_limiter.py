@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общий для всех процессов ограничитель запросов к API Битрикс24
+Token bucket хранится в файле SQLite, поэтому воркеры gunicorn, CRON и
+остальные скрипты расходуют один лимит портала. Запросы обслуживаются по классам приоритета
+(priority.py): пока ждут запросы старшего класса, младшие не берут токены, а фоновые
+не расходуют последние BITRIX_BACKGROUND_RESERVE токенов
+"""
+
+import os
+import time
+import asyncio
+import logging
+
+from local_db import LocalDB
+from metrics import RATE_LIMIT_WAIT_SECONDS
+from priority import PRIORITY_BACKGROUND, current_priority, higher_priorities
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0,
+    backoff REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS method_blocks (
+    method TEXT PRIMARY KEY,
+    blocked_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS demand (
+    priority TEXT PRIMARY KEY,
+    waiting_until REAL NOT NULL
+);
+"""
+
+# Ошибки Битрикс24 о превышении лимитов
+QUERY_LIMIT_EXCEEDED = 'QUERY_LIMIT_EXCEEDED'
+OPERATION_TIME_LIMIT = 'OPERATION_TIME_LIMIT'
+
+
+class RateLimiter:
+    """
+    Token bucket с адаптивной паузой
+    После QUERY_LIMIT_EXCEEDED все процессы ждут, пауза удваивается до успешного запроса;
+    метод, израсходовавший лимит времени выполнения (operating), блокируется до сброса.
+    Ожидающий запрос отмечает спрос своего класса, и младшие классы уступают ему токены
+    """
+
+    def __init__(self, db_path=None, rate=None, burst=None, portal='default'):
+        self.db_path = db_path or os.getenv('RATE_LIMIT_DB_PATH', 'rate_limiter.db')
+        self.rate = rate or float(os.getenv('BITRIX_RATE_LIMIT', '2'))
+        self.burst = burst or float(os.getenv('BITRIX_RATE_BURST', '50'))
+        self.max_retries = int(os.getenv('BITRIX_THROTTLE_RETRIES', '3'))
+        self.base_backoff = float(os.getenv('BITRIX_THROTTLE_BACKOFF', '1'))
+        self.max_backoff = float(os.getenv('BITRIX_THROTTLE_MAX_BACKOFF', '60'))
+        # Лимит Битрикс24 - 480 секунд выполнения метода за 10 минут
+        self.operating_threshold = float(os.getenv('BITRIX_OPERATING_THRESHOLD', '400'))
+        # Токены, которые фоновые запросы оставляют событиям вебхука (меньше пачки, иначе фон не получит токен)
+        self.background_reserve = min(float(os.getenv('BITRIX_BACKGROUND_RESERVE', '10')), self.burst - 1)
+        # Имя портала для меток метрик
+        self.portal = portal
+        self.db = LocalDB(self.db_path, SCHEMA)
+        self.db.conn().execute(
+            'INSERT OR IGNORE INTO bucket (id, tokens, updated_at) VALUES (1, ?, ?)',
+            (self.burst, time.time())
+        )
+        self._backoff_active = False
+
+    def try_acquire(self, method, priority=None):
+        """
+        Попытка взять токен для запроса к методу с классом приоритета priority (по умолчанию текущий)
+        Возвращает 0, если токен получен, иначе время ожидания в секундах
+        """
+        priority = priority or current_priority()
+        higher = higher_priorities(priority)
+        now = time.time()
+        with self.db.transaction() as conn:
+            tokens, updated_at, blocked_until = conn.execute(
+                'SELECT tokens, updated_at, blocked_until FROM bucket WHERE id = 1'
+            ).fetchone()
+            method_block = conn.execute(
+                'SELECT blocked_until FROM method_blocks WHERE method = ?', (method,)
+            ).fetchone()
+            wait = max(blocked_until, method_block[0] if method_block else 0) - now
+            if wait > 0:
+                return wait
+
+            # Старший класс ждёт токен - уступаем ему
+            if higher:
+                waiting_until = conn.execute(
+                    f"SELECT MAX(waiting_until) FROM demand WHERE priority IN ({', '.join('?' * len(higher))})",
+                    higher
+                ).fetchone()[0]
+                if waiting_until and waiting_until > now:
+                    return min(waiting_until - now, 1 / self.rate)
+
+            reserve = self.background_reserve if priority == PRIORITY_BACKGROUND else 0
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            acquired = tokens >= 1 + reserve
+            conn.execute(
+                'UPDATE bucket SET tokens = ?, updated_at = ? WHERE id = 1',
+                (tokens - 1 if acquired else tokens, now)
+            )
+            if acquired:
+                return 0
+
+            wait = (1 + reserve - tokens) / self.rate
+            # Спрос класса виден младшим классам, пока ожидающий не вернётся за токеном
+            conn.execute(
+                'INSERT OR REPLACE INTO demand (priority, waiting_until) VALUES (?, ?)',
+                (priority, now + wait + 1 / self.rate)
+            )
+            return wait
+
+    def acquire(self, method):
+        """Ожидание права на запрос к методу"""
+        priority = current_priority()
+        started = time.time()
+        while True:
+            wait = self.try_acquire(method, priority)
+            if not wait:
+                RATE_LIMIT_WAIT_SECONDS.labels(priority, self.portal).observe(time.time() - started)
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, method):
+        """
+        Ожидание права на запрос к методу без блокировки цикла событий
+        try_acquire() выполняется в потоке: BEGIN IMMEDIATE может ждать блокировку базы до busy_timeout
+        """
+        priority = current_priority()
+        started = time.time()
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, method, priority)
+            if not wait:
+                RATE_LIMIT_WAIT_SECONDS.labels(priority, self.portal).observe(time.time() - started)
+                return
+            await asyncio.sleep(wait)
+
+    def check_throttled(self, method, response):
+        """
+        Проверка ответа на превышение лимитов
+        Возвращает True, если запрос нужно повторить после паузы
+        """
+        if response.status_code not in (429, 503):
+            return False
+        try:
+            error = response.json().get('error')
+        except ValueError:
+            error = None
+
+        if error == OPERATION_TIME_LIMIT:
+            self.block_method(method, time.time() + self.max_backoff)
+            return True
+        if error == QUERY_LIMIT_EXCEEDED or response.status_code == 429:
+            self.penalize()
+            return True
+        return False
+
+    def penalize(self):
+        """Пауза для всех процессов после QUERY_LIMIT_EXCEEDED"""
+        now = time.time()
+        with self.db.transaction() as conn:
+            backoff = conn.execute('SELECT backoff FROM bucket WHERE id = 1').fetchone()[0]
+            backoff = min(max(backoff * 2, self.base_backoff), self.max_backoff)
+            conn.execute(
+                'UPDATE bucket SET tokens = 0, updated_at = ?, blocked_until = ?, backoff = ? WHERE id = 1',
+                (now, now + backoff, backoff)
+            )
+        self._backoff_active = True
+        logger.warning(f"Bitrix rate limit exceeded, backing off for {backoff:.1f}s")
+
+    def block_method(self, method, until):
+        """Блокировка метода до указанного момента"""
+        self.db.conn().execute(
+            'INSERT OR REPLACE INTO method_blocks (method, blocked_until) VALUES (?, ?)',
+            (method, until)
+        )
+        logger.warning(f"Bitrix method {method} blocked for {until - time.time():.0f}s")
+
+    def observe(self, method, data):
+        """Учёт успешного ответа: сброс паузы и подсказки operating из поля time"""
+        if self._backoff_active:
+            self.db.conn().execute('UPDATE bucket SET backoff = 0 WHERE id = 1')
+            self._backoff_active = False
+
+        timing = data.get('time') if isinstance(data, dict) else None
+        if not isinstance(timing, dict):
+            return
+        operating = timing.get('operating') or 0
+        if operating >= self.operating_threshold:
+            reset_at = timing.get('operating_reset_at') or time.time() + self.max_backoff
+            self.block_method(method, float(reset_at))
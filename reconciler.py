@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сверка сделок с незаполненной историей причин отказов (замена auto_checker.py)
+Битрикс24 сам отбирает сделки с пустым полем истории и контактом (фильтр на сервере,
+в ответе только нужные поля), сделки обрабатываются параллельно в рамках общего лимита запросов.
+Пауза между проходами растёт, пока работы нет, и сбрасывается, когда она появляется.
+Каждый портал сверяется в своём потоке со своим состоянием
+"""
+
+import os
+import signal
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from app import deal_processors
+from bounded_pool import process_bounded
+from cron_state import CronState
+from priority import PRIORITY_BACKGROUND, set_default_priority
+
+logger = logging.getLogger('reconciler')
+
+
+class Reconciler:
+    """Периодическая сверка сделок"""
+
+    def __init__(self, processor, state=None, concurrency=None, hours=None,
+                 min_interval=None, max_interval=None, recheck_minutes=None):
+        self.processor = processor
+        self.state = state or CronState(
+            db_path=processor.portal.db_path('reconciler_state.db')
+            or os.getenv('RECONCILE_STATE_DB_PATH', 'reconciler_state.db')
+        )
+        self.concurrency = concurrency or int(os.getenv('RECONCILE_CONCURRENCY', '4'))
+        # Окно выборки по DATE_CREATE; 0 - все сделки
+        self.hours = hours if hours is not None else int(os.getenv('RECONCILE_HOURS', '24'))
+        self.min_interval = min_interval or float(os.getenv('RECONCILE_MIN_INTERVAL', '10'))
+        self.max_interval = max_interval or float(os.getenv('RECONCILE_MAX_INTERVAL', '300'))
+        # Сделку без причин отказов у контакта проверяем повторно не чаще, чем раз в recheck_minutes
+        self.recheck_seconds = (recheck_minutes or int(os.getenv('RECONCILE_RECHECK_MINUTES', '60'))) * 60
+        self.interval = self.min_interval
+        self.stop_event = threading.Event()
+
+    def find_unfilled(self):
+        """Сделки с контактом и пустым полем истории (генератор)"""
+        field = self.processor.rejection_history_field
+        filter = {field: False, '!CONTACT_ID': False}
+        if self.hours:
+            since = datetime.now().astimezone() - timedelta(hours=self.hours)
+            filter['>=DATE_CREATE'] = since.isoformat(timespec='seconds')
+        return self.processor.api.iter_list('crm.deal.list', filter=filter, select=['ID', 'CONTACT_ID', field])
+
+    def reconcile_deal(self, deal):
+        """
+        Заполнение истории сделки под блокировкой сделки; сделка уже получена, запрашивается только контакт.
+        Если во время сверки пришло событие сделки, повтор получает сделку заново
+        """
+        def fill():
+            reasons = self.processor.get_contact_rejection_reasons(deal['CONTACT_ID'])
+            return self.processor.fill_rejection_history(deal, reasons)
+
+        return self.processor.deal_locks.run(deal['ID'], fill, rerun=lambda: self.processor.process_unlocked(deal['ID']))
+
+    def run_once(self):
+        """Один проход сверки, возвращает сводку"""
+        summary = {'found': 0, 'processed': 0, 'failed': 0}
+
+        def pending():
+            for deal in self.find_unfilled():
+                if self.stop_event.is_set():
+                    return
+                if self.state.is_processed(deal['ID']):
+                    continue
+                summary['found'] += 1
+                yield deal
+
+        def collect(deal, success, error):
+            if error:
+                logger.error(f"Error reconciling deal {deal['ID']}: {error}")
+            if success:
+                summary['processed'] += 1
+                self.state.mark_processed(deal['ID'])
+            else:
+                summary['failed'] += 1
+
+        self.state.prune(self.recheck_seconds)
+        self.processor.deal_index.prune()
+        process_bounded(pending(), self.reconcile_deal, collect, self.concurrency)
+        return summary
+
+    def next_interval(self, summary):
+        """Пауза до следующего прохода: минимальная, если была работа, иначе вдвое больше прежней"""
+        if summary['found']:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return self.interval
+
+    def run(self):
+        """Цикл сверки до остановки"""
+        logger.info(f"Reconciler of {self.processor.portal.name} started "
+                    f"(concurrency {self.concurrency}, window {self.hours}h)")
+        while not self.stop_event.is_set():
+            try:
+                summary = self.run_once()
+            except Exception as e:
+                logger.error(f"Reconcile pass of {self.processor.portal.name} failed: {e}")
+                summary = {'found': 0, 'processed': 0, 'failed': 0}
+            interval = self.next_interval(summary)
+            logger.info(f"Reconcile pass of {self.processor.portal.name}: {summary['processed']} of {summary['found']} deals processed, "
+                        f"{summary['failed']} failed; next pass in {interval:.0f}s")
+            self.stop_event.wait(interval)
+        logger.info(f"Reconciler of {self.processor.portal.name} stopped")
+
+    def stop(self, *_):
+        """Остановка после текущего прохода"""
+        self.stop_event.set()
+
+
+def main():
+    """Основная функция"""
+    # Сверка уступает лимит запросов событиям вебхука
+    set_default_priority(PRIORITY_BACKGROUND)
+    if not deal_processors:
+        logger.error("BITRIX_WEBHOOK_URL or PORTALS_CONFIG not configured")
+        return
+
+    reconcilers = [Reconciler(processor) for processor in deal_processors.values()]
+    stop_event = threading.Event()
+
+    def stop(*_):
+        stop_event.set()
+        for reconciler in reconcilers:
+            reconciler.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    threads = [
+        threading.Thread(target=reconciler.run, name=f"reconciler-{reconciler.processor.portal.name}")
+        for reconciler in reconcilers
+    ]
+    for thread in threads:
+        thread.start()
+    # Ожидание с таймаутом, чтобы главный поток получал сигналы
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,11 @@ fi
 # Создаем директорию для логов если её нет
 mkdir -p logs
 
+# Каталог метрик Prometheus должен существовать до запуска воркеров
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 # Запускаем сервер через gunicorn
 echo "Запуск Bitrix Deal Webhook сервера..."
 echo "Webhook URL: http://your-server.com/webhook/deal"
@@ -0,0 +1,38 @@
+#!/bin/bash
+
+# Скрипт для запуска асинхронного (ASGI) варианта webhook сервера
+
+# Проверяем наличие .env файла
+if [ ! -f .env ]; then
+    echo "Ошибка: файл .env не найден. Скопируйте .env.example в .env и настройте параметры."
+    exit 1
+fi
+
+# Загружаем переменные окружения
+export $(cat .env | xargs)
+
+# Проверяем обязательные переменные
+if [ -z "$BITRIX_WEBHOOK_URL" ]; then
+    echo "Ошибка: BITRIX_WEBHOOK_URL не настроен в .env файле"
+    exit 1
+fi
+
+# Создаем директорию для логов если её нет
+mkdir -p logs
+
+# Каталог метрик Prometheus должен существовать до запуска воркеров
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+# Один процесс обслуживает сотни сделок одновременно
+echo "Запуск Bitrix Deal Webhook сервера (ASGI)..."
+echo "Webhook URL: http://your-server.com/webhook/deal"
+echo "Health check: http://your-server.com/health"
+
+uvicorn asgi_app:app \
+        --host 0.0.0.0 \
+        --port 5000 \
+        --workers 1 \
+        --timeout-keep-alive 5 \
+        --log-level info
@@ -4,12 +4,15 @@
 Пример скрипта для установки источника в сделку
 """
 
-import requests
 import json
 
+from bitrix_client import BitrixAPI
+
 # Настройки
 WEBHOOK_URL = "https://promarketing1.bitrix24.ru/rest/9/fxn8xyfbalblll9s"
 
+api = BitrixAPI(WEBHOOK_URL, user_agent='BitrixSourceExample/1.0')
+
 def set_deal_source(deal_id, source_id):
     """
     Установить источник для сделки
@@ -22,18 +25,12 @@ def set_deal_source(deal_id, source_id):
     print("Установка источника '{}' для сделки {}...".format(source_id, deal_id))
     
     try:
-        url = "{}/crm.deal.update".format(WEBHOOK_URL)
-        params = {
+        data = api._make_request('crm.deal.update', {
             'id': deal_id,
             'fields': {
                 'SOURCE_ID': source_id
             }
-        }
-        
-        response = requests.post(url, json=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        })
         
         if 'result' in data and data['result']:
             print("✓ Источник успешно установлен!")
@@ -42,9 +39,6 @@ def set_deal_source(deal_id, source_id):
             print("✗ Ошибка: {}".format(data.get('error_description', 'Неизвестная ошибка')))
             return False
             
-    except requests.exceptions.RequestException as e:
-        print("✗ Ошибка запроса: {}".format(e))
-        return False
     except Exception as e:
         print("✗ Неожиданная ошибка: {}".format(e))
         return False
@@ -62,19 +56,13 @@ def create_deal_with_source(title, contact_id, source_id):
     print("Создание сделки '{}' с источником '{}'...".format(title, source_id))
     
     try:
-        url = "{}/crm.deal.add".format(WEBHOOK_URL)
-        params = {
+        data = api._make_request('crm.deal.add', {
             'fields': {
                 'TITLE': title,
                 'CONTACT_ID': contact_id,
                 'SOURCE_ID': source_id
             }
-        }
-        
-        response = requests.post(url, json=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        })
         
         if 'result' in data:
             deal_id = data['result']
@@ -84,9 +72,6 @@ def create_deal_with_source(title, contact_id, source_id):
             print("✗ Ошибка: {}".format(data.get('error_description', 'Неизвестная ошибка')))
             return None
             
-    except requests.exceptions.RequestException as e:
-        print("✗ Ошибка запроса: {}".format(e))
-        return None
     except Exception as e:
         print("✗ Неожиданная ошибка: {}".format(e))
         return None
@@ -95,15 +80,9 @@ def get_deal_info(deal_id):
     """Получить информацию о сделке включая источник"""
     
     try:
-        url = "{}/crm.deal.get".format(WEBHOOK_URL)
-        params = {
+        data = api._make_request('crm.deal.get', {
             'id': deal_id
-        }
-        
-        response = requests.post(url, json=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        })
         
         if 'result' in data:
             deal = data['result']
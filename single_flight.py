@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Объединение одинаковых одновременных запросов (single-flight)
+Пока запрос по ключу выполняется, остальные вызовы с тем же ключом ждут его результат
+и не отправляют свой запрос к API
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    """Выполняющийся вызов и его результат"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Single-flight для потоков"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func):
+        """Результат func(): первый вызов по ключу выполняет её, одновременные получают тот же результат"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """Single-flight для корутин одного цикла событий"""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, func):
+        """Результат await func(): одновременные вызовы по ключу ждут одну задачу"""
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        # Отмена одного из ожидающих не отменяет общий запрос
+        return await asyncio.shield(task)
@@ -7,7 +7,6 @@
 import os
 import sys
 import json
-import requests
 from datetime import datetime
 
 def test_imports():
@@ -15,6 +14,7 @@ def test_imports():
     try:
         import flask
         import requests
+        import bitrix_client
         print("✓ Все модули импортированы успешно")
         return True
     except ImportError as e:
@@ -69,41 +69,38 @@ def test_bitrix_connection():
         return False
     
     try:
+        from bitrix_client import BitrixAPI
+        
         # Тестовый запрос к API
-        test_url = "{}/crm.deal.fields".format(webhook_url.rstrip('/'))
-        response = requests.get(test_url, timeout=10)
+        api = BitrixAPI(webhook_url, user_agent='BitrixSetupCheck/1.0')
+        data = api._make_request('crm.deal.fields')
         
-        if response.status_code == 200:
-            data = response.json()
-            if 'result' in data:
-                print("✓ Соединение с Битрикс24 успешно")
-                
-                # Проверяем наличие настроенных полей
-                fields = data['result']
-                rejection_field = os.getenv('REJECTION_REASON_FIELD', 'UF_CRM_REJECTION_REASON')
-                history_field = os.getenv('REJECTION_HISTORY_FIELD', 'UF_CRM_REJECTION_HISTORY')
-                
-                if rejection_field in fields:
-                    print("✓ Поле причины отказа '{}' найдено".format(rejection_field))
-                else:
-                    print("✗ Поле причины отказа '{}' НЕ найдено".format(rejection_field))
-                    print("  Создайте это поле в настройках CRM")
-                
-                if history_field in fields:
-                    print("✓ Поле истории причин '{}' найдено".format(history_field))
-                else:
-                    print("✗ Поле истории причин '{}' НЕ найдено".format(history_field))
-                    print("  Создайте это поле в настройках CRM")
-                
-                return True
+        if 'result' in data:
+            print("✓ Соединение с Битрикс24 успешно")
+            
+            # Проверяем наличие настроенных полей
+            fields = data['result']
+            rejection_field = os.getenv('REJECTION_REASON_FIELD', 'UF_CRM_REJECTION_REASON')
+            history_field = os.getenv('REJECTION_HISTORY_FIELD', 'UF_CRM_REJECTION_HISTORY')
+            
+            if rejection_field in fields:
+                print("✓ Поле причины отказа '{}' найдено".format(rejection_field))
             else:
-                print("✗ Некорректный ответ от API: {}".format(data))
-                return False
+                print("✗ Поле причины отказа '{}' НЕ найдено".format(rejection_field))
+                print("  Создайте это поле в настройках CRM")
+            
+            if history_field in fields:
+                print("✓ Поле истории причин '{}' найдено".format(history_field))
+            else:
+                print("✗ Поле истории причин '{}' НЕ найдено".format(history_field))
+                print("  Создайте это поле в настройках CRM")
+            
+            return True
         else:
-            print("✗ Ошибка HTTP {}: {}".format(response.status_code, response.text))
+            print("✗ Ошибка API {}: {}".format(data.get('error'), data.get('error_description')))
             return False
             
-    except requests.exceptions.RequestException as e:
+    except Exception as e:
         print("✗ Ошибка соединения: {}".format(e))
         return False
 
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Разбор входящих вебхуков Битрикс24
+Исходящие вебхуки Битрикс24 приходят формой (application/x-www-form-urlencoded)
+с ключами вида data[FIELDS][ID], auth[application_token]; поддерживается и JSON.
+Из тела извлекаются только событие, ID сущности, токен и домен портала, без построения вложенных словарей
+"""
+
+import json
+from urllib.parse import unquote_plus
+
+# События, которые обрабатывает сервис; остальные отбрасываются до дальнейшего разбора
+HANDLED_EVENTS = frozenset(('ONCRMDEALADD', 'ONCRMDEALUPDATE', 'ONCRMCONTACTUPDATE'))
+
+FORM_FIELDS = {
+    'event': 'event',
+    'data[FIELDS][ID]': 'id',
+    'auth[application_token]': 'token',
+    'auth[domain]': 'domain'
+}
+
+
+def _key_variants(key):
+    """Ключ формы как есть и с закодированными скобками"""
+    yield key
+    yield key.replace('[', '%5B').replace(']', '%5D')
+    yield key.replace('[', '%5b').replace(']', '%5d')
+
+
+_FORM_KEYS = {variant.encode(): name for key, name in FORM_FIELDS.items() for variant in _key_variants(key)}
+
+
+def parse_form(body):
+    """Разбор тела формы: только нужные ключи, остановка после ненужного события"""
+    result = dict.fromkeys(FORM_FIELDS.values())
+    found = 0
+    for pair in body.split(b'&'):
+        key, _, value = pair.partition(b'=')
+        name = _FORM_KEYS.get(key)
+        if name is None or result[name] is not None:
+            continue
+
+        result[name] = unquote_plus(value.decode('ascii', 'replace'))
+        if name == 'event' and result['event'] not in HANDLED_EVENTS:
+            return result
+        found += 1
+        if found == len(FORM_FIELDS):
+            break
+    return result
+
+
+def parse_json(body):
+    """Разбор тела JSON"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    fields = data.get('data')
+    fields = fields.get('FIELDS') if isinstance(fields, dict) else None
+    auth = data.get('auth')
+    return {
+        'event': data.get('event'),
+        'id': fields.get('ID') if isinstance(fields, dict) else None,
+        'token': auth.get('application_token') if isinstance(auth, dict) else None,
+        'domain': auth.get('domain') if isinstance(auth, dict) else None
+    }
+
+
+def parse_payload(body, content_type=None):
+    """
+    Событие вебхука из тела запроса: {'event', 'id', 'token', 'domain'}
+    Возвращает None, если тело пустое или не разбирается
+    """
+    body = body.strip()
+    if not body:
+        return None
+    if body[:1] in (b'{', b'[') or 'json' in (content_type or ''):
+        return parse_json(body)
+    return parse_form(body)
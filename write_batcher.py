@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Групповая запись сделок (group commit)
+Обновления сделок, пришедшие в течение WRITE_BATCH_WINDOW_MS, отправляются одним batch-запросом
+до 50 команд crm.deal.update; каждый вызов получает результат своей команды в формате update_deal(),
+поэтому ошибка одной сделки не влияет на остальные. Первый вызов в окне ждёт и отправляет пачку,
+остальные ждут его результата. Одиночное обновление отправляется обычным crm.deal.update.
+В потоках окно ждёт только пока процесс уже отправляет другую пачку: одиночная запись
+(синхронный воркер gunicorn) уходит сразу, без задержки на окно.
+Пачка получает лимит запросов по старшему классу приоритета своих обновлений
+"""
+
+import os
+import asyncio
+import threading
+import logging
+
+from bitrix_client import BatchRequest, error_result
+from metrics import WRITE_BATCH_SIZE
+from priority import PRIORITIES, current_priority, use_priority
+
+logger = logging.getLogger(__name__)
+
+
+class _Write:
+    """Обновление одной сделки в пачке"""
+
+    def __init__(self, deal_id, fields):
+        self.deal_id = deal_id
+        self.fields = fields
+        self.priority = current_priority()
+        self.result = None
+
+
+class _Batch:
+    """Пачка обновлений, которую отправляет её первый вызов"""
+
+    def __init__(self, full, done=None):
+        self.writes = []
+        # Пачка набрана полностью - отправлять, не дожидаясь конца окна
+        self.full = full
+        # Пачка отправлена, результаты разложены по вызовам (Event для потоков, задача для корутин)
+        self.done = done
+
+
+class BaseWriteBatcher:
+    """Общая часть групповой записи: сборка batch-запроса и разбор результатов по сделкам"""
+
+    def __init__(self, api, window=None, max_size=BatchRequest.MAX_COMMANDS):
+        self.api = api
+        self.window = (window if window is not None else float(os.getenv('WRITE_BATCH_WINDOW_MS', '50'))) / 1000
+        self.max_size = max_size
+
+    @staticmethod
+    def build(writes):
+        """batch-запрос обновлений пачки; команды именуются по порядку, сделка может повторяться"""
+        batch = BatchRequest()
+        for i, write in enumerate(writes):
+            batch.add(f"u{i}", 'crm.deal.update', {'ID': write.deal_id, 'fields': write.fields})
+        return batch
+
+    @staticmethod
+    def priority(writes):
+        """Старший класс приоритета среди обновлений пачки"""
+        return min((write.priority for write in writes), key=PRIORITIES.index)
+
+    def unpack(self, writes, batch_result):
+        """Раскладывание результата batch-запроса по обновлениям"""
+        WRITE_BATCH_SIZE.labels(self.api.portal).observe(len(writes))
+        if not batch_result:
+            for write in writes:
+                write.result = error_result('BATCH_FAILED', 'Deal update batch request failed')
+            logger.error(f"Deal update batch of {len(writes)} deals failed")
+            return
+
+        for i, write in enumerate(writes):
+            name = f"u{i}"
+            if name in batch_result['errors']:
+                error = batch_result['errors'][name]
+                write.result = error if isinstance(error, dict) else error_result('UNKNOWN', str(error))
+                logger.error(f"Failed to update deal {write.deal_id} in batch: {write.result.get('error')}")
+            elif name in batch_result['result']:
+                write.result = {'result': batch_result['result'][name]}
+            else:
+                write.result = error_result('BATCH_NO_RESULT', 'No result for the command in batch response')
+
+
+class WriteBatcher(BaseWriteBatcher):
+    """Групповая запись для потоков (BitrixAPI)"""
+
+    def __init__(self, api, window=None, max_size=BatchRequest.MAX_COMMANDS):
+        super().__init__(api, window, max_size)
+        self.lock = threading.Lock()
+        self.current = None
+        # Пачки, которые собираются или отправляются сейчас
+        self.sending = 0
+
+    def update(self, deal_id, fields):
+        """Обновление сделки в составе пачки, возвращает ответ как update_deal()"""
+        if self.window <= 0:
+            return self.api.update_deal(deal_id, fields)
+
+        write = _Write(deal_id, fields)
+        with self.lock:
+            batch = self.current
+            leader = batch is None
+            if leader:
+                batch = _Batch(threading.Event(), threading.Event())
+                # Пока другие пачки не отправляются, ждать некого: обновление уходит сразу
+                collect = self.sending > 0
+                if collect:
+                    self.current = batch
+                self.sending += 1
+            batch.writes.append(write)
+            if len(batch.writes) >= self.max_size:
+                self.current = None
+                batch.full.set()
+
+        if not leader:
+            batch.done.wait()
+            return write.result
+
+        if collect:
+            batch.full.wait(self.window)
+            with self.lock:
+                if self.current is batch:
+                    self.current = None
+        try:
+            with use_priority(self.priority(batch.writes)):
+                self.flush(batch.writes)
+        except Exception as e:
+            logger.error(f"Error flushing deal update batch: {e}")
+            for item in batch.writes:
+                item.result = item.result or error_result('BATCH_FAILED', str(e))
+        finally:
+            with self.lock:
+                self.sending -= 1
+            batch.done.set()
+        return write.result
+
+    def flush(self, writes):
+        """Отправка пачки"""
+        if len(writes) == 1:
+            WRITE_BATCH_SIZE.labels(self.api.portal).observe(1)
+            writes[0].result = self.api.update_deal(writes[0].deal_id, writes[0].fields)
+            return
+        self.unpack(writes, self.api.call_batch(self.build(writes)))
+
+
+class AsyncWriteBatcher(BaseWriteBatcher):
+    """Групповая запись для корутин одного цикла событий (AsyncBitrixAPI)"""
+
+    def __init__(self, api, window=None, max_size=BatchRequest.MAX_COMMANDS):
+        super().__init__(api, window, max_size)
+        self.current = None
+
+    async def update(self, deal_id, fields):
+        """Обновление сделки в составе пачки, возвращает ответ как update_deal()"""
+        if self.window <= 0:
+            return await self.api.update_deal(deal_id, fields)
+
+        write = _Write(deal_id, fields)
+        batch = self.current
+        if batch is None:
+            batch = self.current = _Batch(asyncio.Event())
+            # Пачку отправляет отдельная задача: отмена первого вызова не оставляет остальные без ответа
+            batch.done = asyncio.ensure_future(self.send(batch))
+        batch.writes.append(write)
+        if len(batch.writes) >= self.max_size:
+            self.current = None
+            batch.full.set()
+
+        await asyncio.shield(batch.done)
+        return write.result
+
+    async def send(self, batch):
+        """Ожидание окна (или заполнения пачки) и отправка"""
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self.current is batch:
+            self.current = None
+        try:
+            with use_priority(self.priority(batch.writes)):
+                await self.flush(batch.writes)
+        except Exception as e:
+            logger.error(f"Error flushing deal update batch: {e}")
+            for item in batch.writes:
+                item.result = item.result or error_result('BATCH_FAILED', str(e))
+
+    async def flush(self, writes):
+        """Отправка пачки"""
+        if len(writes) == 1:
+            WRITE_BATCH_SIZE.labels(self.api.portal).observe(1)
+            writes[0].result = await self.api.update_deal(writes[0].deal_id, writes[0].fields)
+            return
+        self.unpack(writes, await self.api.call_batch(self.build(writes)))